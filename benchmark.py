@@ -0,0 +1,407 @@
+"""Load test / benchmark harness for the X Campus API.
+
+Starts main.py with uvicorn against a throwaway SQLite file seeded with
+realistic data, drives every hot route at a given concurrency and reports
+p50/p95/p99 latency, throughput, errors and server RSS.
+
+    python benchmark.py                              # run everything
+    python benchmark.py --routes match,chatbot -c 32 -n 2000
+    python benchmark.py --workers 4                  # multi-process server
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --compare bench_baseline.json
+
+--compare exits with status 1 when a route's p95 got slower than the
+baseline by more than --threshold percent, so it can gate a deploy.
+Only the standard library is used on the client side.
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+BRANCHES = ["CE", "IT", "ME", "EE", "EC", "CIVIL"]
+CLASSES = ["FY", "SY", "TY", "LY"]
+SKILLS = ["python", "java", "c", "c++", "machine learning", "web development", "design", "dsa",
+          "data analysis", "finance", "communication", "video editing", "android", "cloud"]
+ITEMS = ["bottle", "wallet", "calculator", "umbrella", "id card", "earphones", "charger", "notebook", "keys", "watch"]
+COLOURS = ["blue", "black", "red", "steel", "green", "white"]
+CHAT_QUERIES = ["when does the canteen open", "exam dates?", "hostel curfew", "wifi password", "library timings",
+                "how to start as a new student", "what are the rules", "tell me a joke"]
+CITIES = ["Vadodara", "Ahmedabad", "Surat", "Pune", "Mumbai", "Delhi", "Bangalore", "Chennai"]
+PASSWORD = "bench-password"
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+# 1x1 RGBA PNG used for upload routes - it has to decode, the server checks images
+PNG = (b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 6, 0, 0, 0))
+       + png_chunk(b"IDAT", zlib.compress(b"\x00" * 5)) + png_chunk(b"IEND", b""))
+
+# ========================================
+# SEEDING
+# ========================================
+
+def seed_database(path, scale):
+    from passlib.context import CryptContext
+
+    # The app owns the schema - create it with the same migrations it runs on startup
+    subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, "main.py"), "migrate"],
+        env=dict(os.environ, XCAMPUS_DATA_DIR=os.path.dirname(path), XCAMPUS_DB_PATH=path),
+        check=True, stdout=subprocess.DEVNULL
+    )
+
+    rng = random.Random(42)
+    conn = sqlite3.connect(path)
+    now = datetime.now()
+    stamp = now.strftime("%d %b %Y %H:%M:%S")
+    epoch = int(now.timestamp())
+
+    conn.executemany(
+        "INSERT INTO lost_item (item_name, item_description, founder_name, founder_number, founder_class, founder_branch, file_path, time, time_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(
+            f"{rng.choice(COLOURS)} {rng.choice(ITEMS)}",
+            f"found near block {rng.randint(1, 9)}, {rng.choice(COLOURS)} {rng.choice(ITEMS)}",
+            f"Founder {i}", f"98{i:08d}", rng.choice(CLASSES), rng.choice(BRANCHES),
+            f"uploads/item_{i}.png",
+            (now - timedelta(minutes=i * 7)).strftime("%d %b %Y %H:%M:%S"),
+            epoch - i * 7 * 60
+        ) for i in range(scale * 20)]
+    )
+
+    id_password = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    conn.executemany(
+        "INSERT INTO student_id (name, roll_number, branch, year, college_name, college_contact, id_image_path, qr_path, password, time, time_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(f"Student {i}", f"ROLL{i:05d}", rng.choice(BRANCHES), str(rng.randint(1, 4)), "X Campus College", "0265-000000",
+          f"idcards/{i}.png", f"qrcodes/{i}.png", id_password, stamp, epoch)
+         for i in range(scale * 10)]
+    )
+
+    # One real bcrypt hash shared by all accounts - hashing thousands would dominate setup
+    password_hash = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(PASSWORD)
+    conn.executemany(
+        "INSERT INTO student_register (name, email, phone, branch, year, password_hash, photo_path, time, time_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(f"Student {i}", f"student{i}@bench.test", "9000000000", rng.choice(BRANCHES), str(rng.randint(1, 4)),
+          password_hash, "student_photos/x.png", stamp, epoch)
+         for i in range(scale * 10)]
+    )
+    conn.executemany(
+        "INSERT INTO staff_register (name, email, phone, department, designation, password_hash, photo_path, time, time_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(f"Staff {i}", f"staff{i}@bench.test", "9000000000", rng.choice(BRANCHES), "Professor",
+          password_hash, "staff_photos/x.png", stamp, epoch)
+         for i in range(scale)]
+    )
+
+    conn.executemany(
+        "INSERT INTO senior_connect (name, branch, year, skills, availability, contact) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"Senior {i}", rng.choice(BRANCHES), str(rng.randint(2, 4)), ", ".join(rng.sample(SKILLS, 3)),
+          rng.choice(["weekends", "evenings", "busy", "mon-fri"]), f"senior{i}@bench.test")
+         for i in range(scale * 5)]
+    )
+    conn.executemany(
+        "INSERT INTO junior_request (name, branch, year, query, skill_needed) VALUES (?, ?, ?, ?, ?)",
+        [(f"Junior {i}", rng.choice(BRANCHES), "1", "need guidance", rng.choice(SKILLS)) for i in range(scale * 2)]
+    )
+    conn.commit()
+    conn.close()
+
+# ========================================
+# SERVER
+# ========================================
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workdir, db_file, port, workers):
+    # Same entry point as production; the scratch data dir keeps uploads out of the repo
+    env = dict(
+        os.environ,
+        XCAMPUS_DATA_DIR=workdir,
+        XCAMPUS_DB_PATH=db_file,
+        XCAMPUS_PORT=str(port),
+        XCAMPUS_WORKERS=str(workers),
+        XCAMPUS_RELOAD="0",
+        XCAMPUS_LOG_LEVEL="warning",
+        # One client hammering every route would only measure the 429 path
+        XCAMPUS_RATE_LIMIT="0",
+        XCAMPUS_BASE_URL=f"http://127.0.0.1:{port}",
+    )
+    env.setdefault("XCAMPUS_SECRET_KEY", "benchmark-secret")
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "main.py")], cwd=workdir, env=env)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("Server did not become healthy in time")
+
+def _process_tree(pid):
+    pids = [pid]
+    for child in pids:
+        try:
+            with open(f"/proc/{child}/task/{child}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+def rss_mb(pid):
+    # Linux only; None elsewhere. Sums the uvicorn supervisor and its workers.
+    total = 0
+    try:
+        for child in _process_tree(pid):
+            with open(f"/proc/{child}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+    except OSError:
+        return None
+    return round(total / 1024, 1)
+
+# ========================================
+# REQUESTS
+# ========================================
+
+def form(fields):
+    return urlencode(fields).encode(), {"Content-Type": "application/x-www-form-urlencoded"}
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+def unique_png(i):
+    # Distinct bytes per upload so the media store can't dedupe the work away
+    return PNG + f"#{i}-{uuid.uuid4().hex}".encode()
+
+def unique_key(i):
+    # Emails and roll numbers for registration routes - never already taken
+    return f"{i}{uuid.uuid4().hex[:10]}"
+
+# Each route builds (method, path, body, headers) for request number i
+ROUTES = {
+    "health": lambda i, ctx: ("GET", "/health", None, {}),
+    "lost_items": lambda i, ctx: ("GET", "/item/lost_items/?limit=20", None, {}),
+    "lost_items_filtered": lambda i, ctx: ("GET", "/item/lost_items/?" + urlencode({"branch": BRANCHES[i % len(BRANCHES)], "limit": 20}), None, {}),
+    "lost_item_upload": lambda i, ctx: ("POST", "/item/lost_item/", *multipart(
+        {"item_name": "bench item", "item_description": "benchmark upload", "founder_name": "Bench",
+         "founder_number": "1", "founder_class": "SY", "founder_branch": "CE"},
+        {"file": (f"bench_{i}.png", unique_png(i), "image/png")}
+    )),
+    "idcard_upload": lambda i, ctx: ("POST", "/idcard/upload/", *multipart(
+        {"name": f"Bench {i}", "roll_number": f"B{unique_key(i)}", "branch": "CE", "year": "2",
+         "college_name": "X Campus College", "college_contact": "0265-000000", "password": PASSWORD},
+        {"file": (f"card_{i}.png", unique_png(i), "image/png")}
+    )),
+    "student_register": lambda i, ctx: ("POST", "/student/register/", *multipart(
+        {"name": f"Bench {i}", "email": f"new{unique_key(i)}@bench.test", "phone": "9000000000",
+         "branch": "CE", "year": "1", "password": PASSWORD},
+        {"photo": (f"student_{i}.png", unique_png(i), "image/png")}
+    )),
+    "staff_register": lambda i, ctx: ("POST", "/staff/register/", *multipart(
+        {"name": f"Bench {i}", "email": f"new{unique_key(i)}@bench.test", "phone": "9000000000",
+         "department": "CE", "designation": "Professor", "password": PASSWORD},
+        {"photo": (f"staff_{i}.png", unique_png(i), "image/png")}
+    )),
+    "search_lost_items": lambda i, ctx: ("GET", "/search/lost_items/?" + urlencode({"q": ITEMS[i % len(ITEMS)]}), None, {}),
+    "student_login": lambda i, ctx: ("POST", "/student/login/", *form(
+        {"email": f"student{i % ctx['scale']}@bench.test", "password": PASSWORD}
+    )),
+    "staff_login": lambda i, ctx: ("POST", "/staff/login/", *form(
+        {"email": f"staff{i % ctx['staff']}@bench.test", "password": PASSWORD}
+    )),
+    "idcard_view_secure": lambda i, ctx: ("POST", "/idcard/view_secure/", *form(
+        {"roll_number": f"ROLL{i % ctx['scale']:05d}", "password": PASSWORD}
+    )),
+    "match": lambda i, ctx: ("GET", "/connect/match/?" + urlencode({"skill": SKILLS[i % len(SKILLS)]}), None, {}),
+    "chatbot": lambda i, ctx: ("POST", "/chatbot/query", *form({"query": CHAT_QUERIES[i % len(CHAT_QUERIES)]})),
+    "college": lambda i, ctx: ("POST", "/college/recommend/", *form(
+        {"percentage": 50 + i % 50, "skill": ["coding", "design", "finance"][i % 3], "city": CITIES[i % len(CITIES)]}
+    )),
+}
+
+_local = threading.local()
+
+def send(port, method, path, body, headers):
+    # One keep-alive connection per client thread
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    start = time.perf_counter()
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        conn.close()
+        _local.conn = None
+        status = 0
+    return time.perf_counter() - start, status
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index] * 1000, 2)
+
+def run_route(name, port, pid, requests, concurrency, ctx):
+    build = ROUTES[name]
+    specs = [build(i, ctx) for i in range(requests)]
+    # Warmup requests of their own: replaying measured uploads would make the
+    # measured run hit already-stored blobs and taken emails
+    warmup = [build(requests + i, ctx) for i in range(concurrency)]
+    rss_before = rss_mb(pid)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        # Warm up connections and caches before measuring
+        list(pool.map(lambda spec: send(port, *spec), warmup))
+        start = time.perf_counter()
+        results = list(pool.map(lambda spec: send(port, *spec), specs))
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    errors = sum(1 for r in results if not 200 <= r[1] < 300)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": percentile(latencies, 100),
+        "rss_mb_before": rss_before,
+        "rss_mb_after": rss_mb(pid),
+    }
+
+# ========================================
+# REPORTING
+# ========================================
+
+def print_report(results, baseline=None):
+    header = f"{'route':<22}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>6}{'rss MB':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>14}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        line = f"{name:<22}{r['throughput_rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['errors']:>6}{str(r['rss_mb_after']):>9}"
+        if baseline:
+            line += f"{format_change(r, baseline.get(name)):>14}"
+        print(line)
+
+def format_change(result, base):
+    if not base or not base.get("p95_ms"):
+        return "new"
+    change = (result["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+    return f"{change:+.1f}%"
+
+def regressions(results, baseline, threshold):
+    slower = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base and base.get("p95_ms") and r["p95_ms"] > base["p95_ms"] * (1 + threshold / 100):
+            slower.append(name)
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the X Campus API")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="comma separated, default: all")
+    parser.add_argument("-n", "--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--scale", type=int, default=200, help="seed size multiplier (students = 10x)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument("--threshold", type=float, default=20, help="allowed p95 regression in percent")
+    parser.add_argument("--keep", action="store_true", help="keep the temp directory for inspection")
+    args = parser.parse_args()
+
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = [r for r in routes if r not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)} (choose from {', '.join(ROUTES)})")
+
+    workdir = tempfile.mkdtemp(prefix="xcampus_bench_")
+    db_file = os.path.join(workdir, "bench.db")
+    print(f"Seeding {db_file} (scale {args.scale})...")
+    seed_database(db_file, args.scale)
+
+    port = free_port()
+    server = start_server(workdir, db_file, port, args.workers)
+    try:
+        ctx = {"scale": args.scale * 10, "staff": args.scale}
+        results = {}
+        for name in routes:
+            print(f"  {name}...", flush=True)
+            results[name] = run_route(name, port, server.pid, args.requests, args.concurrency, ctx)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print()
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "cpus": os.cpu_count(),
+                "settings": {"requests": args.requests, "concurrency": args.concurrency, "scale": args.scale, "workers": args.workers},
+                "results": results
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if baseline:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            print(f"\nRegression: p95 more than {args.threshold:g}% slower for {', '.join(slower)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,1560 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Header, Depends, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager, contextmanager, suppress
+import asyncio
+import base64
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import multiprocessing
 import os
+import queue
+import re
+import shutil
 import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from functools import lru_cache
+from mimetypes import guess_type
+from collections import OrderedDict, deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-import qrcode
-from passlib.context import CryptContext
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from urllib.parse import quote
+from pydantic import BaseModel
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# qrcode, Pillow and passlib are imported where they are used, so workers
+# start (and restart during deploys) without paying for them up front.
+
+# ========================================
+# SETTINGS
+# ========================================
+
+# Each setting comes from the environment (XCAMPUS_<NAME>) or from the JSON
+# file named by XCAMPUS_CONFIG (default: xcampus.json next to this file).
+# The environment wins. See xcampus.example.json.
+CONFIG_PATH = os.environ.get(
+    "XCAMPUS_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "xcampus.json")
+)
+
+def _load_config_file(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+config_file = _load_config_file(CONFIG_PATH)
+
+def setting(name, default=None, cast=str):
+    value = os.environ.get(f"XCAMPUS_{name.upper()}")
+    if value is None:
+        value = config_file.get(name)
+    if value is None:
+        return default
+    if cast is bool and isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return cast(value)
+
+HOST = setting("host", "127.0.0.1")
+PORT = setting("port", 8000, int)
+WORKERS = setting("workers", os.cpu_count() or 1, int)
+RELOAD = setting("reload", False, bool)
+LOG_LEVEL = setting("log_level", "info")
+GRACEFUL_TIMEOUT = setting("graceful_timeout", 30, int)  # seconds to drain on shutdown
+
+# Relative paths (database, uploads, media, ...) resolve against the data
+# directory; the launcher below changes into it before starting workers.
+DATA_DIR = setting("data_dir", ".")
+
+# Startup / shutdown: pools, migrations and caches live for the whole app lifetime
+@asynccontextmanager
+async def lifespan(app):
+    global db_pool
+    for directory in UPLOAD_DIRECTORIES:
+        os.makedirs(directory, exist_ok=True)
+    clean_stale_uploads()
+    db_pool = ConnectionPool(db_path, size=DB_POOL_SIZE)
+
+    # Workers start together - only one at a time may run migrations
+    with startup_lock(db_path + ".startup.lock"):
+        migrate()
+        build_static()
+    check_query_plans()
+    qr_jobs.start()
+    await qr_jobs.recover()
+    image_processor.start()
+
+    # Warm in-memory indexes and caches before taking traffic
+    db_pool.warm(2)
+    senior_matcher.refresh()
+    qr_verifier.refresh(force=True)
+    password_hasher.start()
+    chatbot.load()
+    college_catalog.load()
+    await event_bus.start()
+    try:
+        yield
+    finally:
+        await event_bus.stop()
+        await drain_uploads(GRACEFUL_TIMEOUT)
+        password_hasher.stop()
+        await qr_jobs.stop()
+        await run_in_threadpool(image_processor.stop)
+        db_pool.close()
+
+@contextmanager
+def startup_lock(path):
+    # Cross-process exclusive lock on a small side file next to the database
+    with open(path, "a+") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
 # Initialize FastAPI app
-app = FastAPI(title="X Campus API", version="1.0.0")
+app = FastAPI(title="X Campus API", version="1.0.0", lifespan=lifespan)
 
-# CORS configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # For development - restrict in production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# CORS configuration - see the middleware stack after RATE LIMITING
+
+# Password hashing (created on first use - see get_pwd_context)
+pwd_context = None
+
+def get_pwd_context():
+    global pwd_context
+    if pwd_context is None:
+        from passlib.context import CryptContext
+        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return pwd_context
+
+# Database path - set XCAMPUS_DB_PATH (relative to the data directory)
+db_path = setting("db_path", "X Campus.db")
+
+# ========================================
+# METRICS
+# ========================================
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_QUERY_SECONDS = setting("slow_query_ms", 100, float) / 1000
+PROFILING_ENABLED = setting("profiling", False, bool)
+PROFILE_DIR = "profiles"
+
+slow_query_log = logging.getLogger("xcampus.slow_query")
+
+class Metric:
+    """Minimal Prometheus metric: values keyed by label tuple."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self.values = {}
+        metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # per-bucket counts, then sum and count
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', '+Inf')])} {counts[-1]}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {round(counts[-2], 6)}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {counts[-1]}")
+        return lines
+
+metrics = []
+
+http_requests = Counter("xcampus_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_latency = Histogram("xcampus_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_in_flight = Gauge("xcampus_http_requests_in_flight", "HTTP requests currently being served")
+db_latency = Histogram("xcampus_db_query_duration_seconds", "SQLite statement latency", ("op",))
+db_slow_queries = Counter("xcampus_db_slow_queries_total", "SQLite statements slower than the slow-query threshold", ("op",))
+upload_count = Counter("xcampus_uploads_total", "Accepted uploads", ("kind",))
+upload_bytes = Counter("xcampus_upload_bytes_total", "Bytes received in accepted uploads", ("kind",))
+hash_latency = Histogram("xcampus_password_hash_duration_seconds", "bcrypt hash/verify latency including queueing", ("op",))
+qr_latency = Histogram("xcampus_qr_render_duration_seconds", "QR image generation latency including queueing")
+pool_gauge = Gauge("xcampus_db_pool", "Connection pool counters", ("stat",))
+
+def describe_params(params):
+    # Parameter values are emails, phone numbers and password hashes - only
+    # their shape goes to the log
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in params.items()) + "}"
+    if isinstance(params, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+    return f"<{len(params)} rows>" if hasattr(params, "__len__") else "<rows>"
+
+def observe_query(op, sql, params, seconds):
+    db_latency.observe(seconds, op=op)
+    if seconds >= SLOW_QUERY_SECONDS:
+        db_slow_queries.inc(op=op)
+        slow_query_log.warning("slow %s (%.1f ms): %s params=%s", op, seconds * 1000, " ".join(sql.split()), describe_params(params))
+
+def render_metrics():
+    # Point-in-time values are copied in when scraped
+    if db_pool:
+        for stat, value in db_pool.snapshot().items():
+            pool_gauge.set(value, stat=stat)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route latency, status counts and in-flight requests.
+
+    With XCAMPUS_PROFILING=1, a request carrying "X-Profile: 1" is profiled
+    with pyinstrument (501 if it isn't installed) and the report is written
+    to profiles/; its path is returned in the X-Profile-File header. One
+    request is profiled at a time per worker; others get 409 meanwhile.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+        profiler = None
+        if PROFILING_ENABLED and (b"x-profile", b"1") in scope.get("headers", []):
+            if not profile_lock.acquire(blocking=False):
+                return await send_limit_response(send, 409, "Another request is being profiled")
+            profiler = start_profiler()
+            if profiler is None:
+                profile_lock.release()
+                return await send_limit_response(send, 501, "Profiling needs pyinstrument (pip install pyinstrument)")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if profiler:
+                    path = profile_path(scope)
+                    message.setdefault("headers", []).append((b"x-profile-file", path.encode()))
+                    status["profile"] = path
+            await send(message)
+
+        http_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.inc(-1)
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            http_latency.observe(elapsed, method=scope["method"], route=route)
+            http_requests.inc(method=scope["method"], route=route, status=status["code"])
+            if profiler:
+                try:
+                    stop_profiler(profiler, status.get("profile") or profile_path(scope))
+                finally:
+                    profile_lock.release()
+
+# Profilers hook the interpreter globally, so only one runs at a time
+profile_lock = threading.Lock()
+
+def start_profiler():
+    """Start a pyinstrument profiler for one request; None if it isn't installed."""
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        return None
+    profiler = Profiler(async_mode="enabled")
+    profiler.start()
+    return profiler
+
+def profile_path(scope):
+    name = re.sub(r"[^\w]+", "_", scope["path"]).strip("_") or "root"
+    return os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{name}")
+
+def stop_profiler(profiler, path):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.stop()
+    with open(path + ".html", "w") as f:
+        f.write(profiler.output_html())
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# ========================================
+# DATABASE CONNECTION POOL
+# ========================================
+
+DB_POOL_SIZE = setting("db_pool_size", 8, int)  # max open connections
+DB_BUSY_TIMEOUT_MS = 5000  # how long SQLite waits on a locked database
+DB_CHECKOUT_TIMEOUT = 10   # seconds to wait for a free connection
+DB_LOCK_RETRIES = 5        # retries after "database is locked" on writes
+
+class ConnectionPool:
+    """Bounded pool of WAL-mode SQLite connections shared by all endpoints."""
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        # SQLite has a single writer; queueing our own writers here is cheaper
+        # than letting them spin on busy_timeout. Other processes still rely
+        # on busy_timeout and the lock retries below.
+        self._write_lock = threading.Lock()
+        self.stats = {"checkouts": 0, "waits": 0, "lock_retries": 0, "connections": 0}
+
+    def _connect(self):
+        # check_same_thread=False: connections move between threadpool workers,
+        # but the pool guarantees only one thread uses a connection at a time.
+        # cached_statements keeps prepared statements alive across requests.
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def _checkout(self):
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        with self._lock:
+            self.stats["checkouts"] += 1
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                self.stats["connections"] = self._created
+                create = True
+            else:
+                self.stats["waits"] += 1
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self.stats["connections"] = self._created
+                raise
+        try:
+            return self._idle.get(timeout=DB_CHECKOUT_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError("Timed out waiting for a database connection")
+
+    def _release(self, conn, broken=False):
+        if broken or self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+                self.stats["connections"] = self._created
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.ProgrammingError:
+            # e.g. connection closed underneath us - don't hand it out again
+            broken = True
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn, broken)
+
+    @contextmanager
+    def transaction(self):
+        """Run several statements atomically on one connection."""
+        with self._write_lock, self.connection() as conn:
+            start = time.perf_counter()
+            yield conn
+            conn.commit()
+            observe_query("transaction", "(transaction)", (), time.perf_counter() - start)
+
+    def query(self, sql, params=(), one=False):
+        with self.connection() as conn:
+            start = time.perf_counter()
+            cursor = conn.execute(sql, params)
+            rows = cursor.fetchone() if one else cursor.fetchall()
+            observe_query("query", sql, params, time.perf_counter() - start)
+            return rows
+
+    def execute(self, sql, params=()):
+        """Run a single write statement with retries on lock contention."""
+        for attempt in range(DB_LOCK_RETRIES + 1):
+            try:
+                with self._write_lock, self.connection() as conn:
+                    start = time.perf_counter()
+                    cursor = conn.execute(sql, params)
+                    conn.commit()
+                    observe_query("execute", sql, params, time.perf_counter() - start)
+                    return cursor.lastrowid
+            except sqlite3.OperationalError as e:
+                if not _is_locked_error(e) or attempt == DB_LOCK_RETRIES:
+                    raise
+                with self._lock:
+                    self.stats["lock_retries"] += 1
+                time.sleep(0.05 * (2 ** attempt))
+
+    def warm(self, count):
+        # Open a few connections up front so the first requests don't pay for it
+        conns = [self._checkout() for _ in range(min(count, self.size))]
+        for conn in conns:
+            self._release(conn)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, size=self.size, idle=self._idle.qsize())
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+def _is_locked_error(e):
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+# Created on startup (see lifespan)
+db_pool = None
+
+def db_query(sql, params=(), one=False):
+    return db_pool.query(sql, params, one)
+
+def db_execute(sql, params=()):
+    return db_pool.execute(sql, params)
+
+async def db_run(func, *args, **kwargs):
+    # Async routes must not block the event loop on SQLite I/O
+    return await run_in_threadpool(func, *args, **kwargs)
+
+# ========================================
+# SCHEMA & MIGRATIONS
+# ========================================
+
+# The tables the original endpoints were written against
+BASE_TABLES = [
+    """CREATE TABLE IF NOT EXISTS lost_item (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, item_name TEXT, item_description TEXT, founder_name TEXT,
+        founder_number TEXT, founder_class TEXT, founder_branch TEXT, file_path TEXT, time TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS student_id (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, roll_number TEXT, branch TEXT, year TEXT,
+        college_name TEXT, college_contact TEXT, id_image_path TEXT, qr_path TEXT, password TEXT, time TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS student_register (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, email TEXT, phone TEXT, branch TEXT, year TEXT,
+        password_hash TEXT, photo_path TEXT, time TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS staff_register (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, email TEXT, phone TEXT, department TEXT,
+        designation TEXT, password_hash TEXT, photo_path TEXT, time TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS senior_connect (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, branch TEXT, year TEXT, skills TEXT,
+        availability TEXT, contact TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS junior_request (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, branch TEXT, year TEXT, query TEXT, skill_needed TEXT
+    )""",
+]
+
+# Login and ID-card lookups. Case-insensitive, so "A@x.com" and "a@x.com"
+# are one account; queries compare with COLLATE NOCASE to use them.
+LOOKUP_INDEXES = [
+    ("idx_student_id_roll_number", "student_id", "roll_number"),
+    ("idx_student_register_email", "student_register", "email"),
+    ("idx_staff_register_email", "staff_register", "email"),
+]
+
+def create_base_tables():
+    with db_pool.transaction() as conn:
+        for sql in BASE_TABLES:
+            conn.execute(sql)
+
+def ensure_lookup_indexes():
+    """Unique lookup indexes, or plain ones while the data still has duplicates.
+
+    Runs on every start: once the duplicates are cleaned up the index is
+    upgraded to unique automatically.
+    """
+    existing = {row[0]: row[1] for row in db_query("SELECT name, sql FROM sqlite_master WHERE type = 'index'")}
+    for name, table, column in LOOKUP_INDEXES:
+        if (existing.get(name) or "").startswith("CREATE UNIQUE"):
+            continue
+        duplicates = db_query(f"""
+            SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {column} IS NOT NULL
+                                  GROUP BY {column} COLLATE NOCASE HAVING COUNT(*) > 1)
+        """, one=True)[0]
+        if duplicates:
+            if name not in existing:
+                db_execute(f"CREATE INDEX {name} ON {table} ({column} COLLATE NOCASE)")
+            print(f"{table}.{column} has {duplicates} duplicated values - indexed but not unique until they are removed")
+            continue
+        with db_pool.transaction() as conn:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+            conn.execute(f"CREATE UNIQUE INDEX {name} ON {table} ({column} COLLATE NOCASE)")
+
+def add_time_epoch(table):
+    """Add a numeric time_epoch column next to the text `time` and backfill it.
+
+    `time` is stored as "%d %b %Y %H:%M:%S", which doesn't sort, so ordering
+    and date ranges use time_epoch instead.
+    """
+    columns = [row[1] for row in db_query(f"PRAGMA table_info({table})")]
+    if "time_epoch" not in columns:
+        db_execute(f"ALTER TABLE {table} ADD COLUMN time_epoch INTEGER")
+
+    # Backfill in batches so a big table doesn't hold the write lock for long
+    while True:
+        rows = db_query(f"SELECT rowid, time FROM {table} WHERE time_epoch IS NULL LIMIT 500")
+        if not rows:
+            break
+        updates = []
+        for rowid, text in rows:
+            try:
+                epoch = int(datetime.strptime(text, TIME_FORMAT).timestamp())
+            except (TypeError, ValueError):
+                epoch = 0
+            updates.append((epoch, rowid))
+        with db_pool.transaction() as conn:
+            conn.executemany(f"UPDATE {table} SET time_epoch = ? WHERE rowid = ?", updates)
+
+def add_staff_approval():
+    # Staff rights are granted by an approved staff member (or the
+    # approve-staff command), never by self-registration
+    columns = [row[1] for row in db_query("PRAGMA table_info(staff_register)")]
+    if "approved" not in columns:
+        db_execute("ALTER TABLE staff_register ADD COLUMN approved INTEGER NOT NULL DEFAULT 0")
+
+def set_staff_approval(email, approved):
+    """Grant or withdraw staff rights (blocking). Returns False for an unknown email."""
+    with db_pool.transaction() as conn:
+        row = conn.execute(
+            "UPDATE staff_register SET approved = ? WHERE email = ? COLLATE NOCASE RETURNING email",
+            (int(approved), email.strip())
+        ).fetchone()
+    return row is not None
+
+# Applied in order, once each, and recorded in schema_version. Every step
+# must be safe to re-run: a crash between a step and its record repeats it.
+# Steps 2-8 created their tables on every start before versioning existed.
+MIGRATIONS = [
+    (1, "Base tables", create_base_tables),
+    (2, "Sortable lost item time", lambda: migrate_lost_item_time()),
+    (3, "Media blob store", lambda: media_store.init_db()),
+    (4, "Full-text search indexes", lambda: init_search_index()),
+    (5, "Junior request status and matches", lambda: senior_matcher.init_db()),
+    (6, "QR job queue", lambda: qr_jobs.init_db()),
+    (7, "Lost item reports and matches", lambda: init_lost_reports()),
+    (8, "Event outbox", lambda: event_bus.init_db()),
+    (9, "Sortable registration times", lambda: [add_time_epoch(t) for t in ("student_id", "student_register", "staff_register")]),
+    (10, "Signed QR tokens, revocations and gate scans", lambda: qr_verifier.init_db()),
+    (11, "Image processing state", lambda: image_processor.init_db()),
+    (12, "Staff approval", add_staff_approval),
+    (13, "Cross-worker cache generations and login lockouts", lambda: [response_cache.init_db(), login_limiter.init_db()]),
+    (14, "Lost item image lookup", lambda: db_execute("CREATE INDEX IF NOT EXISTS idx_lost_item_file_path ON lost_item (file_path)")),
+    (15, "QR job claims", lambda: qr_jobs.add_claims()),
+    (16, "Cache source fingerprints", lambda: response_cache.add_fingerprints()),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate():
+    """Bring the database up to SCHEMA_VERSION. Callers hold startup_lock."""
+    db_execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            time TEXT
+        )
+    """)
+    applied = {row[0] for row in db_query("SELECT version FROM schema_version")}
+    for version, description, step in MIGRATIONS:
+        if version in applied:
+            continue
+        start = time.perf_counter()
+        step()
+        db_execute(
+            "INSERT INTO schema_version (version, description, time) VALUES (?, ?, ?)",
+            (version, description, datetime.now().strftime(TIME_FORMAT))
+        )
+        print(f"Applied migration {version}: {description} ({time.perf_counter() - start:.2f}s)")
+    ensure_lookup_indexes()
+    db_execute("PRAGMA optimize")
+
+def schema_version():
+    return db_query("SELECT MAX(version) FROM schema_version", one=True)[0]
+
+# Queries on the request path that must stay index lookups as tables grow
+HOT_QUERIES = {
+    "student_login": "SELECT name, password_hash FROM student_register WHERE email = ? COLLATE NOCASE",
+    "staff_login": "SELECT name, password_hash FROM staff_register WHERE email = ? COLLATE NOCASE",
+    "idcard_lookup": "SELECT * FROM student_id WHERE roll_number = ? COLLATE NOCASE AND password = ?",
+    "lost_items_page": "SELECT rowid FROM lost_item WHERE (time_epoch, rowid) < (?, ?) ORDER BY time_epoch DESC, rowid DESC LIMIT 20",
+    "lost_items_branch": "SELECT rowid FROM lost_item WHERE founder_branch = ? ORDER BY time_epoch DESC, rowid DESC LIMIT 20",
+    "qr_batch": "SELECT status, COUNT(*) FROM qr_job WHERE batch = ? GROUP BY status",
+    "open_junior_requests": "SELECT rowid FROM junior_request WHERE status = 'open' ORDER BY rowid",
+    "pending_events": "SELECT id FROM event_outbox WHERE status = 'pending' ORDER BY id LIMIT 20",
+    "report_matches": "SELECT item_id FROM lost_match WHERE report_id = ?",
+    "lost_item_image": "SELECT 1 FROM lost_item WHERE file_path = ? LIMIT 1",
+}
+
+def explain_hot_queries():
+    """EXPLAIN QUERY PLAN for HOT_QUERIES; full table scans are flagged."""
+    results = {}
+    for name, sql in HOT_QUERIES.items():
+        params = (None,) * sql.count("?")
+        plan = [row[3] for row in db_query(f"EXPLAIN QUERY PLAN {sql}", params)]
+        # "SCAN t USING INDEX ..." walks an index in order - fine for LIMITed pages
+        scans = [step for step in plan if step.startswith("SCAN") and "USING" not in step and "VIRTUAL TABLE" not in step]
+        results[name] = {"plan": plan, "full_scan": bool(scans)}
+    return results
+
+def check_query_plans():
+    slow = [name for name, result in explain_hot_queries().items() if result["full_scan"]]
+    if slow:
+        print(f"Hot queries doing full table scans: {', '.join(slow)}")
+    return not slow
+
+# Directories for file uploads (created on startup)
+UPLOAD_DIRECTORIES = ["uploads", "student_photos", "staff_photos", "idcards", "qrcodes", "media", "media_tmp", "static"]
+
+# ========================================
+# STATIC FILES
+# ========================================
+
+# Files named by their content hash never change, so browsers may keep them
+# for a year without revalidating. Everything else revalidates via ETag.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+FRONTEND_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bhai_4.html")
+PRECOMPRESS_EXTENSIONS = (".html", ".js", ".css", ".json", ".svg", ".txt")
+GZIP_MIN_SIZE = setting("gzip_min_size", 1024, int)  # bytes; smaller API responses go out as-is
+
+try:
+    import brotli
+except ImportError:  # optional - gzip only
+    brotli = None
+
+class MediaFiles(StaticFiles):
+    """StaticFiles with Cache-Control and precompressed (.br / .gz) variants.
+
+    FileResponse already answers Range and conditional requests and, on
+    servers that support the ASGI pathsend extension, hands the file to the
+    server for zero-copy sending.
+    """
+
+    def __init__(self, *args, cache_control=REVALIDATE_CACHE_CONTROL, precompressed=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+        self.precompressed = precompressed
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        headers = {"Cache-Control": self.cache_control}
+        media_type = guess_type(full_path)[0]
+        if self.precompressed:
+            headers["Vary"] = "Accept-Encoding"
+            variant = self.encoded_variant(full_path, request_headers.get("accept-encoding", ""))
+            if variant:
+                encoding, full_path, stat_result = variant
+                headers["Content-Encoding"] = encoding
+
+        response = FileResponse(
+            full_path, status_code=status_code, headers=headers,
+            media_type=media_type, stat_result=stat_result
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def encoded_variant(self, full_path, accept_encoding):
+        accepted = {part.split(";")[0].strip() for part in accept_encoding.split(",")}
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding in accepted:
+                try:
+                    return encoding, full_path + suffix, os.stat(full_path + suffix)
+                except FileNotFoundError:
+                    continue
+        return None
+
+def precompress(path):
+    """Write .gz (and .br when brotli is installed) next to `path` if stale."""
+    mtime = os.stat(path).st_mtime
+    encoders = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli:
+        encoders.append((".br", lambda data: brotli.compress(data, quality=11)))
+    data = None
+    for suffix, encode in encoders:
+        target = path + suffix
+        if os.path.exists(target) and os.stat(target).st_mtime >= mtime:
+            continue
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        with open(target + ".part", "wb") as f:
+            f.write(encode(data))
+        os.replace(target + ".part", target)
+
+def build_static():
+    # The page is copied into static/ so /app never exposes the source tree
+    if os.path.exists(FRONTEND_PAGE):
+        target = os.path.join("static", "index.html")
+        if not os.path.exists(target) or os.stat(target).st_mtime < os.stat(FRONTEND_PAGE).st_mtime:
+            shutil.copy2(FRONTEND_PAGE, target + ".part")
+            os.replace(target + ".part", target)
+    for entry in os.scandir("static"):
+        if entry.is_file() and entry.name.endswith(PRECOMPRESS_EXTENSIONS):
+            precompress(entry.path)
+
+class APIGZipMiddleware:
+    """GZip for API responses only; static mounts handle their own encoding."""
+
+    def __init__(self, app, minimum_size=GZIP_MIN_SIZE):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=6)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith(STATIC_PREFIXES):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+# Mount static file directories (check_dir=False: they may not exist until startup)
+app.mount("/uploads", MediaFiles(directory="uploads", check_dir=False), name="uploads")
+app.mount("/student_photos", MediaFiles(directory="student_photos", check_dir=False), name="student_photos")
+app.mount("/staff_photos", MediaFiles(directory="staff_photos", check_dir=False), name="staff_photos")
+app.mount("/idcards", MediaFiles(directory="idcards", check_dir=False), name="idcards")
+# QR images and media blobs are named by a hash of their content
+app.mount("/qrcodes", MediaFiles(directory="qrcodes", check_dir=False, cache_control=IMMUTABLE_CACHE_CONTROL), name="qrcodes")
+app.mount("/media", MediaFiles(directory="media", check_dir=False, cache_control=IMMUTABLE_CACHE_CONTROL), name="media")
+
+# Frontend (bhai_4.html) at /app/, precompressed on startup
+app.mount("/app", MediaFiles(directory="static", check_dir=False, html=True, precompressed=True), name="frontend")
+
+STATIC_PREFIXES = ("/uploads/", "/student_photos/", "/staff_photos/", "/idcards/", "/qrcodes/", "/media/", "/app")
+
+# ========================================
+# MEDIA STORE
+# ========================================
+
+# Public address used in links and QR codes - set XCAMPUS_BASE_URL when deploying
+BASE_URL = setting("base_url", f"http://127.0.0.1:{PORT}").rstrip("/")
+
+# Derivatives generated once per new image blob: name -> max (width, height)
+MEDIA_VARIANTS = {
+    "thumb": (320, 320),
+    "web": (1280, 1280),
+}
+
+class MediaStore:
+    """Content-addressed blob store: media/ab/cd/<sha256>.<ext>.
+
+    Identical uploads share one file; media_blob keeps a reference count per
+    blob and the list of derivatives that were generated for it. New blobs
+    wait in media_tmp/ until the image processor has cleaned them.
+    """
+
+    def __init__(self, root="media"):
+        self.root = root
+
+    def init_db(self):
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS media_blob (
+                hash TEXT PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 1,
+                variants TEXT NOT NULL DEFAULT '',
+                time TEXT
+            )
+        """)
+
+    def blob_path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def staged_path(self, digest, ext):
+        return os.path.join("media_tmp", f"{digest}{ext}")
+
+    def variant_path(self, digest, variant):
+        # Variants are recorded as "name.ext"; bare names predate WebP derivatives
+        name, _, ext = variant.partition(".")
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}_{name}.{ext or 'jpg'}")
+
+    def ingest(self, tmp_path, digest, size, ext):
+        """Register a fully written temp file (blocking - run in a thread).
+
+        Returns the blob path. A new blob is staged and handed to the image
+        processor; the file appears at the path once it has been cleaned. If
+        the blob already exists the temp file is dropped and only the
+        reference count goes up. Raises ValueError for bytes the image
+        processor has already rejected - their path will never exist.
+        """
+        dest = self.blob_path(digest, ext)
+        with db_pool.transaction() as conn:
+            row = conn.execute("""
+                INSERT INTO media_blob (hash, path, size, refcount, status, time) VALUES (?, ?, ?, 1, 'pending', ?)
+                ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1 WHERE status != 'rejected'
+                RETURNING path, refcount
+            """, (digest, dest, size, datetime.now().strftime("%d %b %Y %H:%M:%S"))).fetchone()
+            if row is None:
+                error = conn.execute("SELECT error FROM media_blob WHERE hash = ?", (digest,)).fetchone()[0]
+                raise ValueError(f"Image rejected: {error or UNSUPPORTED_IMAGE}")
+        path, refcount = row
+
+        if refcount == 1:
+            os.replace(tmp_path, self.staged_path(digest, ext))
+            image_processor.submit(digest, path)
+        else:
+            os.remove(tmp_path)
+        return path
+
+    def release(self, digest):
+        """Drop one reference; delete the blob and its derivatives at zero."""
+        with db_pool.transaction() as conn:
+            row = conn.execute(
+                "UPDATE media_blob SET refcount = refcount - 1 WHERE hash = ? RETURNING path, refcount, variants",
+                (digest,)
+            ).fetchone()
+            if row and row[1] <= 0:
+                conn.execute("DELETE FROM media_blob WHERE hash = ?", (digest,))
+        if row and row[1] <= 0:
+            self.remove_files(digest, row[0], row[2])
+
+    def remove_files(self, digest, path, variants):
+        paths = [self.variant_path(digest, variant) for variant in filter(None, variants.split(","))]
+        # A blob still being processed (or rejected) has no file under media/ yet
+        paths += [path, self.staged_path(digest, os.path.splitext(path)[1])]
+        for path in paths:
+            with suppress(FileNotFoundError):
+                os.remove(path)
+
+media_store = MediaStore()
+
+def media_url(path, variants="", variant=None):
+    """Public URL for a stored file, preferring a derivative when it exists."""
+    if not path:
+        return f"{BASE_URL}/uploads/default.jpg"
+    path = path.replace("\\", "/")
+    if not path.startswith("media/"):
+        # Files saved before the media store - served from their old mount
+        return f"{BASE_URL}/{os.path.basename(os.path.dirname(path))}/{os.path.basename(path)}"
+    if variant:
+        for entry in variants.split(","):
+            if entry.partition(".")[0] == variant:
+                digest = os.path.basename(path).split(".")[0]
+                path = media_store.variant_path(digest, entry).replace("\\", "/")
+                break
+    return f"{BASE_URL}/{path}"
+
+# ========================================
+# IMAGE PROCESSING
+# ========================================
+
+IMAGE_WORKERS = setting("image_workers", 2, int)
+IMAGE_MAX_DIMENSION = setting("image_max_dimension", 2048, int)  # longest side kept, px
+IMAGE_FORMAT = setting("image_format", "webp")  # derivatives: webp or jpeg
+IMAGE_QUALITY = setting("image_quality", 82, int)
+IMAGE_MAX_PIXELS = 50_000_000  # larger images are refused as decompression bombs
+IMAGE_CLAIM_TIMEOUT = 600      # seconds before a job from a dead worker is retried
+
+# Uploads are identified by their first bytes, never by the client's filename
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
 )
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+image_latency = Histogram("xcampus_image_process_duration_seconds", "Upload image processing latency including queueing")
+
+def sniff_image(head):
+    """File extension for an accepted image type, or None."""
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+def _save_image(img, path, fmt, quality, icc_profile=None):
+    options = {"icc_profile": icc_profile} if icc_profile else {}
+    if fmt == "JPEG":
+        options.update(quality=quality, optimize=True, progressive=True)
+    elif fmt == "WEBP":
+        options.update(quality=quality, method=4)
+    elif fmt == "PNG":
+        options.update(optimize=True)
+    tmp = f"{path}.{os.getpid()}.part"
+    img.save(tmp, fmt, **options)
+    os.replace(tmp, path)
+
+def process_image(src, dest, variants, max_dimension, quality):
+    """Validate, strip and downscale one upload (runs in a worker process).
+
+    The cleaned image keeps its own format and is written to `dest`; each
+    derivative in `variants` ({path: (max size, format)}) is written next to
+    it. Metadata (EXIF, GPS, comments) is dropped before re-encoding.
+    Returns (width, height, format, stored size in bytes).
+    """
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    with Image.open(src) as img:
+        img.verify()  # truncated or corrupt files fail here
+    with Image.open(src) as img:
+        fmt = img.format
+        icc_profile = img.info.get("icc_profile")
+        # Apply the camera's rotation before the EXIF tag that carried it is dropped
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension))
+        if fmt == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+            img = img.convert("RGB")
+        # Pillow writes some of img.info (comment, exif) back out on save
+        img.info = {key: value for key, value in img.info.items() if key == "transparency"}
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        _save_image(img, dest, fmt, quality, icc_profile)
+
+        for path, (max_size, variant_format) in variants.items():
+            copy = img.copy()
+            copy.thumbnail(max_size)
+            if copy.mode not in ("RGB", "L"):
+                keep_alpha = variant_format == "WEBP" and (copy.mode in ("RGBA", "LA") or "transparency" in copy.info)
+                copy = copy.convert("RGBA" if keep_alpha else "RGB")
+            _save_image(copy, path, variant_format, quality, icc_profile)
+        return img.width, img.height, fmt, os.path.getsize(dest)
+
+class ImageProcessor:
+    """Cleans new media blobs in a process pool; job state lives on media_blob.
+
+    A blob goes pending -> processing -> ready (or rejected). Decoding and
+    re-encoding is CPU-bound, so it runs in separate processes and the
+    upload request only waits for the row insert; /images/{hash} reports
+    progress. Raw uploads never leave media_tmp/, so nothing with camera
+    metadata is served.
+    """
+
+    def __init__(self, workers=IMAGE_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.variant_format = "JPEG"
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "ready": 0, "rejected": 0, "in_flight": 0}
+
+    def init_db(self):
+        columns = [row[1] for row in db_query("PRAGMA table_info(media_blob)")]
+        # Blobs stored before this stage are already in place under media/
+        for column, kind in (("status", "TEXT NOT NULL DEFAULT 'ready'"), ("width", "INTEGER"),
+                             ("height", "INTEGER"), ("format", "TEXT"), ("error", "TEXT"), ("claimed_at", "INTEGER")):
+            if column not in columns:
+                db_execute(f"ALTER TABLE media_blob ADD COLUMN {column} {kind}")
+        db_execute("""
+            CREATE INDEX IF NOT EXISTS idx_media_blob_unfinished ON media_blob (status)
+            WHERE status IN ('pending', 'processing')
+        """)
+
+    def start(self):
+        from PIL import features
+        if IMAGE_FORMAT.lower() == "webp" and features.check("webp"):
+            self.variant_format = "WEBP"
+        # spawn: the parent is multi-threaded, forking it is not safe
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.recover()
+
+    def stop(self):
+        # Queued jobs are put back to pending and picked up on the next start
+        if self.executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def recover(self):
+        """Requeue blobs left unprocessed by a restart or a dead worker."""
+        now = int(time.time())
+        with db_pool.transaction() as conn:
+            rows = conn.execute("""
+                UPDATE media_blob SET status = 'processing', claimed_at = ?
+                WHERE status = 'pending' OR (status = 'processing' AND claimed_at < ?)
+                RETURNING hash, path
+            """, (now, now - IMAGE_CLAIM_TIMEOUT)).fetchall()
+        for digest, path in rows:
+            self._dispatch(digest, path)
+
+    def submit(self, digest, path):
+        """Queue a freshly staged blob (blocking). Without a pool it stays pending."""
+        if not self.executor:
+            return
+        with db_pool.transaction() as conn:
+            claimed = conn.execute(
+                "UPDATE media_blob SET status = 'processing', claimed_at = ? WHERE hash = ? AND status = 'pending' RETURNING hash",
+                (int(time.time()), digest)
+            ).fetchone()
+        if claimed:
+            self._dispatch(digest, path)
+
+    def _dispatch(self, digest, path):
+        staged = media_store.staged_path(digest, os.path.splitext(path)[1])
+        ext = ".webp" if self.variant_format == "WEBP" else ".jpg"
+        variants = {
+            media_store.variant_path(digest, name + ext): (max_size, self.variant_format)
+            for name, max_size in MEDIA_VARIANTS.items()
+        }
+        with self._lock:
+            self.stats["submitted"] += 1
+            self.stats["in_flight"] += 1
+        future = self.executor.submit(process_image, staged, path, variants, IMAGE_MAX_DIMENSION, IMAGE_QUALITY)
+        names = ",".join(name + ext for name in MEDIA_VARIANTS)
+        future.add_done_callback(
+            lambda future, start=time.perf_counter(): self._finish(digest, path, staged, names, start, future)
+        )
+
+    def _finish(self, digest, path, staged, names, start, future):
+        # Runs on the pool's result thread
+        with self._lock:
+            self.stats["in_flight"] -= 1
+        if future.cancelled() or isinstance(future.exception(), BrokenExecutor):
+            # Not the image's fault - retried by recover() on the next start
+            db_execute("UPDATE media_blob SET status = 'pending' WHERE hash = ?", (digest,))
+            return
+        try:
+            width, height, fmt, size = future.result()
+            image_latency.observe(time.perf_counter() - start)
+            with db_pool.transaction() as conn:
+                row = conn.execute("""
+                    UPDATE media_blob SET status = 'ready', width = ?, height = ?, format = ?, size = ?, variants = ?, error = NULL
+                    WHERE hash = ? RETURNING path
+                """, (width, height, fmt, size, names, digest)).fetchone()
+            if row is None:
+                # Released while it was being processed - nothing references the output
+                media_store.remove_files(digest, path, names)
+            elif db_query("SELECT 1 FROM lost_item WHERE file_path = ? LIMIT 1", (path,), one=True):
+                # Cached lost-item pages can now link the thumbnails. A row
+                # inserted after this check invalidates them itself.
+                response_cache.invalidate("lost_items")
+            result = "ready"
+        except Exception as e:
+            print(f"Image {digest} rejected: {e}")
+            db_execute("UPDATE media_blob SET status = 'rejected', error = ? WHERE hash = ?", (str(e)[:200], digest))
+            result = "rejected"
+        with self._lock:
+            self.stats[result] += 1
+        with suppress(FileNotFoundError):
+            os.remove(staged)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, workers=self.workers, variant_format=self.variant_format)
+
+image_processor = ImageProcessor()
+
+def image_job(digest):
+    return {"hash": digest, "status_url": f"{BASE_URL}/images/{digest}"}
+
+@app.get("/images/{digest}")
+def image_status(digest: str):
+    """Processing state, dimensions and URLs of an uploaded image."""
+    row = db_query(
+        "SELECT path, status, width, height, format, size, variants, error FROM media_blob WHERE hash = ?",
+        (digest,), one=True
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Unknown image")
+    path, status, width, height, fmt, size, variants, error = row
+    ready = status == "ready"
+    return {
+        "hash": digest,
+        "status": status,
+        "width": width,
+        "height": height,
+        "format": fmt,
+        "size": size,
+        "error": error,
+        "url": media_url(path) if ready else None,
+        "variants": {
+            entry.partition(".")[0]: media_url(path, variants, entry.partition(".")[0])
+            for entry in filter(None, variants.split(","))
+        } if ready else {},
+    }
+
+# ========================================
+# UPLOAD PIPELINE
+# ========================================
+
+UPLOAD_CHUNK_SIZE = 256 * 1024  # bytes read from the client per step
+
+# Max accepted size per upload kind
+UPLOAD_LIMITS = {
+    "uploads": 10 * 1024 * 1024,
+    "idcards": 5 * 1024 * 1024,
+    "student_photos": 5 * 1024 * 1024,
+    "staff_photos": 5 * 1024 * 1024,
+}
+
+UNSUPPORTED_IMAGE = "Only JPEG, PNG, GIF or WebP images are accepted"
+
+uploads_in_flight = 0
+
+def clean_stale_uploads(max_age=3600):
+    # Temp files left behind by a worker that died mid-upload
+    cutoff = time.time() - max_age
+    for entry in os.scandir("media_tmp"):
+        if entry.name.endswith(".part") and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+async def drain_uploads(timeout):
+    # Give uploads that are still streaming a chance to finish on shutdown
+    deadline = time.time() + timeout
+    while uploads_in_flight and time.time() < deadline:
+        await asyncio.sleep(0.1)
+    if uploads_in_flight:
+        print(f"Shutting down with {uploads_in_flight} uploads still in progress")
+
+def _open_temp():
+    # Staging dir is on the same filesystem as media/ so ingest can rename
+    return tempfile.NamedTemporaryFile(dir="media_tmp", suffix=".part", delete=False)
+
+def _write_chunk(tmp, hasher, chunk):
+    tmp.write(chunk)
+    hasher.update(chunk)
+
+def _discard_temp(tmp):
+    tmp.close()
+    try:
+        os.remove(tmp.name)
+    except FileNotFoundError:
+        pass
+
+def _finish_temp(tmp):
+    tmp.flush()
+    os.fsync(tmp.fileno())
+    tmp.close()
+
+async def save_upload(file: UploadFile, kind):
+    """Stream an upload into the media store without buffering it in memory.
 
-# Database path - UPDATE THIS TO YOUR PATH
-db_path = "C:\\Users\\Dell\\Desktop\\X Pay DataBase\\X Campus.db"
+    Returns (path, sha256 hex digest, size in bytes). Raises 415 if the
+    first bytes are not a supported image (or the same bytes were rejected
+    before) and 413 as soon as the upload goes over the size limit for its kind.
+    """
+    max_bytes = UPLOAD_LIMITS[kind]
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes // (1024 * 1024)} MB)")
 
-# Create directories for file uploads
-directories = ["uploads", "student_photos", "staff_photos", "idcards", "qrcodes"]
-for directory in directories:
-    os.makedirs(directory, exist_ok=True)
+    global uploads_in_flight
+    uploads_in_flight += 1
+    hasher = hashlib.sha256()
+    size = 0
+    ext = None
+    try:
+        tmp = await run_in_threadpool(_open_temp)
+    except BaseException:
+        uploads_in_flight -= 1
+        raise
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if ext is None:
+                ext = sniff_image(chunk) or ""
+            if not ext:
+                raise HTTPException(status_code=415, detail=UNSUPPORTED_IMAGE)
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes // (1024 * 1024)} MB)")
+            await run_in_threadpool(_write_chunk, tmp, hasher, chunk)
+        if not ext:
+            raise HTTPException(status_code=415, detail=UNSUPPORTED_IMAGE)
+        await run_in_threadpool(_finish_temp, tmp)
+        digest = hasher.hexdigest()
+        try:
+            path = await run_in_threadpool(media_store.ingest, tmp.name, digest, size, ext)
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        upload_count.inc(kind=kind)
+        upload_bytes.inc(size, kind=kind)
+    except BaseException:
+        await run_in_threadpool(_discard_temp, tmp)
+        raise
+    finally:
+        uploads_in_flight -= 1
+        await file.close()
+    return path, digest, size
 
-# Mount static file directories
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-app.mount("/student_photos", StaticFiles(directory="student_photos"), name="student_photos")
-app.mount("/staff_photos", StaticFiles(directory="staff_photos"), name="staff_photos")
-app.mount("/idcards", StaticFiles(directory="idcards"), name="idcards")
-app.mount("/qrcodes", StaticFiles(directory="qrcodes"), name="qrcodes")
+@asynccontextmanager
+async def stored_upload(file: UploadFile, kind):
+    """save_upload for a file that a new row will reference.
 
-# Serve frontend files (optional - if you want to serve HTML from FastAPI)
-# app.mount("/", StaticFiles(directory="frontend", html=True), name="frontend")
+    Yields (path, digest, size). If the block fails - duplicate key, full
+    hashing queue, database error - the blob reference is released again,
+    so rejected requests leave no unreferenced files behind. Keep the row
+    insert as the last step inside the block.
+    """
+    path, digest, size = await save_upload(file, kind)
+    try:
+        yield path, digest, size
+    except BaseException:
+        await db_run(media_store.release, digest)
+        raise
+
+# ========================================
+# RESPONSE CACHE
+# ========================================
+
+RESPONSE_CACHE_TTL = setting("cache_ttl", 60, int)  # seconds
+RESPONSE_CACHE_SIZE = 2000
+# How long a worker trusts its copy of a namespace generation; writes on
+# other workers show up after at most this long
+RESPONSE_CACHE_GENERATION_TTL = 1.0  # seconds
+# Optional shared backend so every worker shares the same entries,
+# e.g. XCAMPUS_CACHE_URL=redis://localhost:6379/0
+RESPONSE_CACHE_URL = setting("cache_url", "")
+
+class MemoryCacheBackend:
+    """Per-process LRU with per-entry expiry.
+
+    Entries are per worker, but the namespace generations live in the
+    cache_generation table, so a write on any worker invalidates every
+    worker's entries at once and all of them report the same Last-Modified.
+    """
+
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def generation(self, namespace):
+        row = db_query(
+            "SELECT generation, modified FROM cache_generation WHERE namespace = ?", (namespace,), one=True
+        )
+        return tuple(row) if row else (0, None)
+
+    def seed(self, namespace):
+        db_execute(
+            "INSERT OR IGNORE INTO cache_generation (namespace, generation, modified) VALUES (?, 1, ?)",
+            (namespace, time.time())
+        )
+
+    def invalidate(self, namespace):
+        db_execute("""
+            INSERT INTO cache_generation (namespace, generation, modified) VALUES (?, 1, ?)
+            ON CONFLICT(namespace) DO UPDATE SET generation = generation + 1, modified = excluded.modified
+        """, (namespace, time.time()))
+
+    def invalidate_if_changed(self, namespace, fingerprint):
+        db_execute("""
+            INSERT INTO cache_generation (namespace, generation, modified, fingerprint) VALUES (?, 1, ?, ?)
+            ON CONFLICT(namespace) DO UPDATE SET generation = generation + 1, modified = excluded.modified,
+                fingerprint = excluded.fingerprint
+            WHERE fingerprint IS NOT excluded.fingerprint
+        """, (namespace, time.time(), fingerprint))
+
+class RedisCacheBackend:
+    """Shared backend on Redis (needs the optional `redis` package)."""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(key, json.dumps(value), ex=ttl)
+
+    def generation(self, namespace):
+        generation, modified = self.client.mget(f"gen:{namespace}", f"mtime:{namespace}")
+        return int(generation or 0), float(modified) if modified else None
+
+    def seed(self, namespace):
+        pipe = self.client.pipeline()
+        pipe.set(f"gen:{namespace}", 1, nx=True)
+        pipe.set(f"mtime:{namespace}", time.time(), ex=30 * 86400, nx=True)
+        pipe.execute()
+
+    def invalidate(self, namespace):
+        pipe = self.client.pipeline()
+        pipe.incr(f"gen:{namespace}")
+        pipe.set(f"mtime:{namespace}", time.time(), ex=30 * 86400)
+        pipe.execute()
+
+    def invalidate_if_changed(self, namespace, fingerprint):
+        previous = self.client.getset(f"fingerprint:{namespace}", fingerprint)
+        if previous is None or previous.decode() != fingerprint:
+            self.invalidate(namespace)
+
+class ResponseCache:
+    """Caches serialized JSON responses per namespace with ETag revalidation.
+
+    Every namespace has a generation counter that is part of each key;
+    writes call invalidate(namespace), which bumps the counter so all old
+    entries become unreachable at once and age out of the LRU/TTL. The time
+    of the last invalidation is served as Last-Modified. Generations are
+    kept in memory for RESPONSE_CACHE_GENERATION_TTL, so a hit does not
+    have to ask the backend for the current one.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0}
+        self._generations = {}
+
+    def init_db(self):
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS cache_generation (
+                namespace TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL,
+                modified REAL NOT NULL
+            )
+        """)
+
+    def add_fingerprints(self):
+        columns = [row[1] for row in db_query("PRAGMA table_info(cache_generation)")]
+        if "fingerprint" not in columns:
+            db_execute("ALTER TABLE cache_generation ADD COLUMN fingerprint TEXT")
+
+    def invalidate(self, namespace):
+        self.backend.invalidate(namespace)
+        # This worker sees its own writes straight away
+        self._generations.pop(namespace, None)
+
+    def invalidate_if_changed(self, namespace, fingerprint):
+        """Invalidate a namespace built from a file only when the file changed.
+
+        Workers starting with the same file keep the shared entries.
+        """
+        self.backend.invalidate_if_changed(namespace, fingerprint)
+        self._generations.pop(namespace, None)
+
+    def generation(self, namespace):
+        cached = self._generations.get(namespace)
+        if cached and cached[2] > time.monotonic():
+            return cached[:2]
+        generation, modified = self.backend.generation(namespace)
+        if modified is None:
+            # First use: record a generation so every worker agrees on
+            # Last-Modified, without flushing what other workers just cached
+            self.backend.seed(namespace)
+            generation, modified = self.backend.generation(namespace)
+        self._generations[namespace] = (generation, modified, time.monotonic() + RESPONSE_CACHE_GENERATION_TTL)
+        return generation, modified
+
+    def serve(self, request, namespace, key, compute, ttl=RESPONSE_CACHE_TTL):
+        generation, modified = self.generation(namespace)
+        cache_key = f"resp:{namespace}:{generation}:{key}"
+        entry = self.backend.get(cache_key)
+        if entry is None:
+            self.stats["misses"] += 1
+            body = json.dumps(compute(), separators=(",", ":"))
+            entry = {
+                "body": body,
+                "etag": '"' + hashlib.sha1(body.encode()).hexdigest()[:20] + '"',
+                "last_modified": formatdate(modified, usegmt=True)
+            }
+            self.backend.set(cache_key, entry, ttl)
+        else:
+            self.stats["hits"] += 1
+
+        headers = {"ETag": entry["etag"], "Last-Modified": entry["last_modified"], "Cache-Control": "no-cache"}
+        if self._not_modified(request, entry):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(entry["body"], media_type="application/json", headers=headers)
+
+    def _not_modified(self, request, entry):
+        if request.method not in ("GET", "HEAD"):
+            return False
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            return entry["etag"] in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(entry["last_modified"])
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def snapshot(self):
+        return dict(self.stats, backend=type(self.backend).__name__)
+
+response_cache = ResponseCache(RedisCacheBackend(RESPONSE_CACHE_URL) if RESPONSE_CACHE_URL else MemoryCacheBackend())
+
+def query_key(request):
+    # Same parameters in any order -> same cache entry
+    return "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
 
 # ========================================
 # LOST & FOUND ENDPOINTS
 # ========================================
 
+TIME_FORMAT = "%d %b %Y %H:%M:%S"
+LOST_ITEMS_PAGE_SIZE = 20
+LOST_ITEMS_MAX_PAGE_SIZE = 100
+
+def migrate_lost_item_time():
+    """Listings order and page on a numeric time_epoch (see add_time_epoch)."""
+    add_time_epoch("lost_item")
+
+    # Indexes end with rowid implicitly, which is the keyset tie-breaker
+    db_execute("CREATE INDEX IF NOT EXISTS idx_lost_item_time ON lost_item (time_epoch)")
+    db_execute("CREATE INDEX IF NOT EXISTS idx_lost_item_branch_time ON lost_item (founder_branch, time_epoch)")
+    db_execute("CREATE INDEX IF NOT EXISTS idx_lost_item_class_time ON lost_item (founder_class, time_epoch)")
+
+def encode_cursor(epoch, rowid):
+    return base64.urlsafe_b64encode(f"{epoch}:{rowid}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        epoch, rowid = base64.urlsafe_b64decode(padded).decode().split(":")
+        return int(epoch), int(rowid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_date(value, end_of_day=False):
+    # date_from / date_to are YYYY-MM-DD, both inclusive
+    try:
+        day = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    epoch = int(day.timestamp())
+    return epoch + 86399 if end_of_day else epoch
+
+def store_lost_item(values):
+    # The row and its event commit together
+    with db_pool.transaction() as conn:
+        item_id = conn.execute("""
+            INSERT INTO lost_item (item_name, item_description, founder_name, founder_number, founder_class, founder_branch, file_path, time, time_epoch)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, values).lastrowid
+        publish(conn, "lost_item.created", {"id": item_id, "name": values[0], "branch": values[5]})
+    return item_id
+
 @app.post("/item/lost_item/")
 async def submit_lost_item(
     item_name: str = Form(...),
@@ -56,64 +1566,673 @@ async def submit_lost_item(
     file: UploadFile = File(...)
 ):
     try:
-        # Save uploaded file
-        file_path = os.path.join("uploads", file.filename)
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-
-        # Insert into database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO lost_item (item_name, item_description, founder_name, founder_number, founder_class, founder_branch, file_path, time)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            item_name,
-            item_description,
-            founder_name,
-            founder_number,
-            founder_class,
-            founder_branch,
-            file_path,
-            datetime.now().strftime("%d %b %Y %H:%M:%S")
-        ))
-        conn.commit()
-        conn.close()
-
-        return {"message": "Lost item submitted successfully!"}
+        # Save uploaded file and insert into database
+        async with stored_upload(file, "uploads") as (file_path, digest, _):
+            now = datetime.now()
+            await db_run(store_lost_item, (
+                item_name,
+                item_description,
+                founder_name,
+                founder_number,
+                founder_class,
+                founder_branch,
+                file_path,
+                now.strftime(TIME_FORMAT),
+                int(now.timestamp())
+            ))
+        await db_run(response_cache.invalidate, "lost_items")
+        event_bus.notify()
+
+        return {"message": "Lost item submitted successfully!", "image": image_job(digest)}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in submit_lost_item: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/item/lost_items/")
-def get_lost_items():
+def get_lost_items(
+    request: Request,
+    limit: int = Query(LOST_ITEMS_PAGE_SIZE, ge=1, le=LOST_ITEMS_MAX_PAGE_SIZE),
+    cursor: str = None,
+    branch: str = None,
+    founder_class: str = Query(None, alias="class"),
+    date_from: str = None,
+    date_to: str = None
+):
+    return response_cache.serve(
+        request, "lost_items", query_key(request),
+        lambda: list_lost_items(limit, cursor, branch, founder_class, date_from, date_to)
+    )
+
+def list_lost_items(limit, cursor=None, branch=None, founder_class=None, date_from=None, date_to=None):
+    # Newest first, paged by (time_epoch, rowid) so each page is an index seek
+    conditions = []
+    params = []
+    if branch:
+        conditions.append("l.founder_branch = ?")
+        params.append(branch)
+    if founder_class:
+        conditions.append("l.founder_class = ?")
+        params.append(founder_class)
+    if date_from:
+        conditions.append("l.time_epoch >= ?")
+        params.append(parse_date(date_from))
+    if date_to:
+        conditions.append("l.time_epoch <= ?")
+        params.append(parse_date(date_to, end_of_day=True))
+    if cursor:
+        conditions.append("(l.time_epoch, l.rowid) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT item_name, item_description, file_path FROM lost_item ORDER BY time DESC")
-        items = cursor.fetchall()
-        conn.close()
+        # Fetch one extra row to know whether there is a next page
+        items = db_query(f"""
+            SELECT l.item_name, l.item_description, l.file_path, m.variants, l.time_epoch, l.rowid
+            FROM lost_item l LEFT JOIN media_blob m ON m.path = l.file_path
+            {where}
+            ORDER BY l.time_epoch DESC, l.rowid DESC
+            LIMIT ?
+        """, (*params, limit + 1))
         
-        # Convert file paths to accessible URLs
+        # Convert file paths to accessible URLs - listings get the thumbnail
         result = []
-        for item in items:
-            filename = os.path.basename(item[2]) if item[2] else "default.jpg"
+        for item in items[:limit]:
             result.append({
                 "name": item[0],
                 "desc": item[1],
-                "img": f"http://127.0.0.1:8000/uploads/{filename}"
+                "img": media_url(item[2], item[3] or "", "thumb"),
+                "img_full": media_url(item[2]),
+                "time": item[4]
             })
         
-        return result
+        next_cursor = encode_cursor(items[limit - 1][4], items[limit - 1][5]) if len(items) > limit else None
+        return {"items": result, "next_cursor": next_cursor}
     except Exception as e:
         print(f"Error in get_lost_items: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch items")
 
+# Owners report what they lost; new found items are matched against open
+# reports in the background (see MATCH CONSUMERS) and announced as events.
+def init_lost_reports():
+    db_execute("""
+        CREATE TABLE IF NOT EXISTS lost_report (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_name TEXT NOT NULL,
+            description TEXT,
+            owner_name TEXT,
+            owner_contact TEXT,
+            time TEXT,
+            time_epoch INTEGER
+        )
+    """)
+    db_execute("CREATE INDEX IF NOT EXISTS idx_lost_report_time ON lost_report (time_epoch)")
+    db_execute("""
+        CREATE TABLE IF NOT EXISTS lost_match (
+            report_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            time TEXT,
+            PRIMARY KEY (report_id, item_id)
+        )
+    """)
+
+@app.post("/item/report_lost/")
+def report_lost_item(
+    item_name: str = Form(...),
+    item_description: str = Form(""),
+    owner_name: str = Form(...),
+    owner_contact: str = Form(...)
+):
+    try:
+        now = datetime.now()
+        with db_pool.transaction() as conn:
+            report_id = conn.execute("""
+                INSERT INTO lost_report (item_name, description, owner_name, owner_contact, time, time_epoch)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (item_name, item_description, owner_name, owner_contact, now.strftime(TIME_FORMAT), int(now.timestamp()))).lastrowid
+            publish(conn, "lost_report.created", {"id": report_id, "name": item_name})
+        event_bus.notify()
+        return {
+            "message": "Report saved - you'll be notified when a matching item is found",
+            "report_id": report_id,
+            "events": f"{BASE_URL}/events/stream?topics=lost_report.matched"
+        }
+    except Exception as e:
+        print(f"Error in report_lost_item: {e}")
+        raise HTTPException(status_code=500, detail="Report failed")
+
+@app.get("/item/reports/{report_id}/matches")
+def get_report_matches(report_id: int):
+    # Report ids are sequential and this is unauthenticated, so founder
+    # contact details stay out of the response
+    rows = db_query("""
+        SELECT l.rowid, l.item_name, l.item_description, l.file_path, m.score, m.time
+        FROM lost_match m JOIN lost_item l ON l.rowid = m.item_id
+        WHERE m.report_id = ? ORDER BY m.score DESC
+    """, (report_id,))
+    return [{
+        "item_id": row[0],
+        "name": row[1],
+        "desc": row[2],
+        "img": media_url(row[3]),
+        "score": row[4],
+        "time": row[5]
+    } for row in rows]
+
+# ========================================
+# SESSION TOKENS
+# ========================================
+
+SECRET_KEY_FILE = os.path.join(DATA_DIR, "secret.key")
+
+def load_secret_key(path):
+    """Read the generated signing key, creating it on first start.
+
+    ID card QR tokens are signed with it and stay valid for a year, so a
+    key that changed on every restart would void every printed card.
+    """
+    for _ in range(50):
+        try:
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return key
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            try:
+                # O_EXCL: when workers start together exactly one writes the key
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(uuid.uuid4().hex + uuid.uuid4().hex)
+            print(f"XCAMPUS_SECRET_KEY not set - generated a signing key in {path}")
+            continue
+        time.sleep(0.01)  # another worker is still writing it
+    raise RuntimeError(f"Could not read the signing key from {path}")
+
+# Signing key for sessions and ID card QR tokens. Set XCAMPUS_SECRET_KEY in
+# production; otherwise a key is generated once and kept in the data dir.
+SECRET_KEY = setting("secret_key", "") or load_secret_key(SECRET_KEY_FILE)
+
+ACCESS_TOKEN_TTL = setting("token_ttl", 900, int)  # seconds
+TOKEN_CACHE_SIZE = 10000
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload_part):
+    return _b64encode(hmac.new(SECRET_KEY.encode(), payload_part.encode(), hashlib.sha256).digest())
+
+def issue_token(subject, role, ttl=ACCESS_TOKEN_TTL, **claims):
+    """HMAC-signed access token: base64(json claims) + "." + base64(signature)."""
+    now = int(time.time())
+    payload = dict(claims, sub=subject, role=role, iat=now, exp=now + ttl)
+    payload_part = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+    return f"{payload_part}.{_sign(payload_part)}"
+
+class TokenCache:
+    """LRU of already verified tokens so repeat calls skip the HMAC and JSON work."""
+
+    def __init__(self, size=TOKEN_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "invalid": 0}
+
+    def verify(self, token):
+        now = time.time()
+        with self._lock:
+            payload = self._tokens.get(token)
+            if payload is not None:
+                if payload["exp"] > now:
+                    self._tokens.move_to_end(token)
+                    self.stats["hits"] += 1
+                    return payload
+                del self._tokens[token]
+            self.stats["misses"] += 1
+
+        try:
+            payload_part, signature = token.split(".")
+            if not hmac.compare_digest(signature, _sign(payload_part)):
+                raise ValueError("bad signature")
+            payload = json.loads(_b64decode(payload_part))
+        except Exception:
+            self.stats["invalid"] += 1
+            return None
+        if payload.get("exp", 0) <= now:
+            return None
+
+        with self._lock:
+            self._tokens[token] = payload
+            if len(self._tokens) > self.size:
+                self._tokens.popitem(last=False)
+        return payload
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, cached=len(self._tokens))
+
+token_cache = TokenCache()
+
+def token_response(token):
+    return {"access_token": token, "token_type": "bearer", "expires_in": ACCESS_TOKEN_TTL}
+
+def require_session(authorization: str = Header(None)):
+    # FastAPI dependency: the claims of a valid "Authorization: Bearer <token>"
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing access token", headers={"WWW-Authenticate": "Bearer"})
+    payload = token_cache.verify(authorization[7:].strip())
+    if not payload:
+        raise HTTPException(status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+    return payload
+
+def require_staff(session: dict = Depends(require_session)):
+    # Anyone can register as staff; only approved accounts get staff rights.
+    # Checked on every call so withdrawing approval applies immediately.
+    if session["role"] != "staff":
+        raise HTTPException(status_code=403, detail="Staff access required")
+    approved = db_query(
+        "SELECT approved FROM staff_register WHERE email = ? COLLATE NOCASE", (session["sub"],), one=True
+    )
+    if not approved or not approved[0]:
+        raise HTTPException(status_code=403, detail="Staff account not approved yet")
+    return session
+
+@app.get("/session/me")
+def session_me(session: dict = Depends(require_session)):
+    return {
+        "subject": session["sub"],
+        "role": session["role"],
+        "name": session.get("name"),
+        "expires_at": session["exp"]
+    }
+
+# ========================================
+# RATE LIMITING
+# ========================================
+
+# Token buckets: each client may burst up to `burst` requests, refilled at
+# `per_minute`. The first matching rule applies; clients are identified by
+# their session subject when they send a valid token, else by IP.
+# Per-account login lockout is handled separately by LoginLimiter.
+RATE_LIMIT_ENABLED = setting("rate_limit", True, bool)
+RATE_LIMIT_URL = setting("rate_limit_url", RESPONSE_CACHE_URL)  # share buckets across workers/hosts
+RATE_LIMIT_MAX_KEYS = 100000  # buckets kept in memory at most
+
+UPLOAD_PATHS = ("/item/lost_item/", "/idcard/upload/", "/student/register/", "/staff/register/", "/roster/")
+# Whole request body per upload path: the file limit plus room for the
+# other form fields. Checked before the multipart body is parsed.
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+ROSTER_MAX_BYTES = setting("roster_max_bytes", 200 * 1024 * 1024, int)
+UPLOAD_BODY_LIMITS = {
+    "/item/lost_item/": UPLOAD_LIMITS["uploads"] + UPLOAD_FORM_OVERHEAD,
+    "/idcard/upload/": UPLOAD_LIMITS["idcards"] + UPLOAD_FORM_OVERHEAD,
+    "/student/register/": UPLOAD_LIMITS["student_photos"] + UPLOAD_FORM_OVERHEAD,
+    "/staff/register/": UPLOAD_LIMITS["staff_photos"] + UPLOAD_FORM_OVERHEAD,
+    "/roster/": ROSTER_MAX_BYTES,
+}
+RATE_LIMIT_EXEMPT = STATIC_PREFIXES + ("/health", "/metrics", "/events/")
+
+# (rule, methods or None for all, path prefixes, per minute, burst)
+RATE_LIMITS = [
+    ("login", {"POST"}, ("/student/login/", "/staff/login/"), 10, 5),
+    ("idcard", {"POST"}, ("/idcard/view_secure/",), 20, 10),
+    # Gate scanners check hundreds of cards a minute; tokens can't be guessed
+    ("qr_verify", None, ("/idcard/verify/",), 3000, 300),
+    ("upload", {"POST"}, UPLOAD_PATHS, 30, 10),
+    ("api", None, ("/",), 600, 120),
+]
+
+# Uploads hold a disk stream, a DB write and image work each; beyond this
+# many at once (per worker) new ones wait briefly, then get 503
+UPLOAD_CONCURRENCY = setting("upload_concurrency", 16, int)
+UPLOAD_QUEUE_WAIT = 2  # seconds
+
+rate_limited = Counter("xcampus_rate_limited_total", "Requests rejected by rate limits", ("rule",))
+
+class MemoryRateStore:
+    """Per-process token buckets, least recently used first.
+
+    A bucket idle long enough to have refilled completely is the same as no
+    bucket, so those are dropped from the old end as new clients arrive.
+    """
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, last refill, seconds to refill fully)
+
+    async def take(self, key, rate, burst):
+        """Take one token. Returns (allowed, seconds until the next token)."""
+        # Only touched from the event loop, so no lock is needed
+        now = time.monotonic()
+        tokens, last, _ = self.buckets.pop(key, (burst, now, 0))
+        tokens = min(burst, tokens + (now - last) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now, (burst - tokens) / rate)
+        self._evict(now)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def _evict(self, now):
+        while self.buckets:
+            key, (_, last, refill) = next(iter(self.buckets.items()))
+            if now - last < refill and len(self.buckets) <= self.max_keys:
+                break
+            del self.buckets[key]
+
+    def snapshot(self):
+        return {"buckets": len(self.buckets)}
+
+class RedisRateStore:
+    """Buckets shared through Redis (needs the optional `redis` package)."""
+
+    # Refill, take and store in one round trip, atomically
+    SCRIPT = """
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+        local tokens = tonumber(bucket[1]) or burst
+        local last = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis.asyncio
+        self.client = redis.asyncio.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    async def take(self, key, rate, burst):
+        wait = float(await self.script(keys=[f"rate:{key}"], args=[rate, burst, time.time()]))
+        return wait == 0, wait
+
+    def snapshot(self):
+        return {"backend": "redis"}
+
+def client_identity(scope):
+    # Signed-in clients get their own bucket even behind a shared NAT
+    for name, value in scope.get("headers", []):
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            payload = token_cache.verify(value[7:].decode("latin-1").strip())
+            if payload:
+                return f"{payload['role']}:{payload['sub']}"
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else "ip:unknown"
+
+def match_rate_rule(method, path):
+    for rule in RATE_LIMITS:
+        name, methods, prefixes, _, _ = rule
+        if (methods is None or method in methods) and path.startswith(prefixes):
+            return rule
+    return None
+
+async def send_limit_response(send, status, detail, retry_after=None):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(max(1, int(retry_after + 0.999))).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+def upload_body_limit(path):
+    for prefix, limit in UPLOAD_BODY_LIMITS.items():
+        if path.startswith(prefix):
+            return limit
+    return None
+
+def limit_body(receive, limit):
+    """Wrap `receive` so a body (chunked or not) stops at `limit` bytes with 413."""
+    received = 0
+
+    async def limited_receive():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > limit:
+                raise HTTPException(status_code=413, detail="Request body too large")
+        return message
+    return limited_receive
+
+class RateLimitMiddleware:
+    """ASGI middleware: token-bucket limits (429), upload body limits (413)
+    and an upload concurrency cap (503)."""
+
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store or (RedisRateStore(RATE_LIMIT_URL) if RATE_LIMIT_URL else MemoryRateStore())
+        self.upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+        rate_limiter_stores.append(self.store)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # The upload concurrency cap below applies even with rate limiting off
+        path = scope.get("path", "")
+        limited = RATE_LIMIT_ENABLED and not path.startswith(RATE_LIMIT_EXEMPT)
+        rule = match_rate_rule(scope["method"], path) if limited else None
+        if rule:
+            name, _, _, per_minute, burst = rule
+            try:
+                allowed, retry_after = await self.store.take(f"{name}:{client_identity(scope)}", per_minute / 60, burst)
+            except Exception as e:
+                # A broken shared store must not take the API down with it
+                print(f"Rate limit store error: {e}")
+                allowed = True
+            if not allowed:
+                rate_limited.inc(rule=name)
+                return await send_limit_response(send, 429, "Too many requests, slow down", retry_after)
+
+        if scope["method"] == "POST" and path.startswith(UPLOAD_PATHS):
+            # Refuse oversized bodies before they are read or spooled to disk
+            limit = upload_body_limit(path)
+            declared = Headers(scope=scope).get("content-length", "")
+            if declared.isdigit() and int(declared) > limit:
+                rate_limited.inc(rule="upload_size")
+                return await send_limit_response(send, 413, "Request body too large")
+            receive = limit_body(receive, limit)
+            try:
+                await asyncio.wait_for(self.upload_slots.acquire(), UPLOAD_QUEUE_WAIT)
+            except asyncio.TimeoutError:
+                rate_limited.inc(rule="upload_concurrency")
+                return await send_limit_response(send, 503, "Server busy, please retry shortly", UPLOAD_QUEUE_WAIT)
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                self.upload_slots.release()
+
+        await self.app(scope, receive, send)
+
+# For /health - filled in when the middleware stack is built
+rate_limiter_stores = []
+
+# Middleware, innermost first. CORS goes outermost so 429/503 responses and
+# errors carry CORS headers too and browsers can read Retry-After.
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(APIGZipMiddleware)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # For development - restrict in production
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Retry-After"],
+)
+
 # ========================================
 # ID CARD ENDPOINTS
 # ========================================
 
-from hashlib import sha256
+QR_WORKERS = setting("qr_workers", 2, int)
+QR_CLAIM_TIMEOUT = 300  # seconds before a pending job from a dead worker is retried
+
+def render_qr(data, path):
+    """Encode `data` as a QR PNG at `path` (runs in a worker process)."""
+    import qrcode
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer)
+    tmp = f"{path}.{os.getpid()}.part"
+    with open(tmp, "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp, path)
+    return path
+
+def qr_payload(roll_number, name=None, issued=None):
+    if QR_MODE == "signed":
+        return f"{BASE_URL}/idcard/verify/{issue_qr_token(roll_number, name, issued)}"
+    return f"{BASE_URL}/idcard/view_secure/{quote(roll_number, safe='')}"
+
+def qr_cache_path(data):
+    # Same payload -> same image, so files are named by the payload hash
+    return os.path.join("qrcodes", f"{hashlib.sha256(data.encode()).hexdigest()}.png")
+
+class QRJobQueue:
+    """Renders QR images in a process pool; job state lives in the qr_job table.
+
+    Image encoding is CPU-bound, so it runs in separate processes and the
+    request only waits for a row insert. Finished images are cached by
+    payload: a job for an existing image completes immediately.
+    """
+
+    def __init__(self, workers=QR_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.tasks = set()
+
+    def init_db(self):
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS qr_job (
+                id TEXT PRIMARY KEY,
+                batch TEXT,
+                payload TEXT NOT NULL,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                time TEXT
+            )
+        """)
+        db_execute("CREATE INDEX IF NOT EXISTS idx_qr_job_batch ON qr_job (batch)")
+
+    def add_claims(self):
+        # claimed_at marks which pending jobs a live worker is rendering, so
+        # recover() on another worker leaves them alone
+        columns = [row[1] for row in db_query("PRAGMA table_info(qr_job)")]
+        if "claimed_at" not in columns:
+            db_execute("ALTER TABLE qr_job ADD COLUMN claimed_at INTEGER")
+        db_execute("CREATE INDEX IF NOT EXISTS idx_qr_job_pending ON qr_job (claimed_at) WHERE status = 'pending'")
+
+    def start(self):
+        # spawn: the parent is multi-threaded, forking it is not safe
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def stop(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.executor:
+            self.executor.shutdown(wait=True)
+
+    def create_jobs(self, payloads, batch=None):
+        """Record one job per payload (blocking). Returns [(job_id, path, status)]."""
+        jobs = []
+        now = datetime.now()
+        for data in payloads:
+            path = qr_cache_path(data)
+            status = "done" if os.path.exists(path) else "pending"
+            # Pending jobs are rendered by this worker right away - claimed from the start
+            claimed_at = int(now.timestamp()) if status == "pending" else None
+            jobs.append((uuid.uuid4().hex, batch, data, path, status, now.strftime("%d %b %Y %H:%M:%S"), claimed_at))
+        with db_pool.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO qr_job (id, batch, payload, path, status, time, claimed_at) VALUES (?, ?, ?, ?, ?, ?, ?)", jobs
+            )
+        return [(job[0], job[3], job[4]) for job in jobs]
+
+    async def submit(self, payloads, batch=None):
+        jobs = await db_run(self.create_jobs, payloads, batch)
+        # Identical payloads in one call only need rendering once
+        pending = {}
+        for (job_id, path, status), data in zip(jobs, payloads):
+            if status == "pending":
+                pending.setdefault(path, (data, []))[1].append(job_id)
+        self._schedule(pending)
+        return jobs
+
+    def claim_stale(self):
+        """Claim pending jobs nobody is rendering (blocking). Returns [(id, payload, path)]."""
+        now = int(time.time())
+        with db_pool.transaction() as conn:
+            return conn.execute("""
+                UPDATE qr_job SET claimed_at = ?
+                WHERE status = 'pending' AND (claimed_at IS NULL OR claimed_at < ?)
+                RETURNING id, payload, path
+            """, (now, now - QR_CLAIM_TIMEOUT)).fetchall()
+
+    async def recover(self):
+        """Requeue jobs left pending by a restart or a dead worker.
+
+        Jobs are claimed atomically, so with several workers starting at
+        once each job is rendered by only one of them.
+        """
+        rows = await db_run(self.claim_stale)
+        pending = {}
+        for job_id, data, path in rows:
+            pending.setdefault(path, (data, []))[1].append(job_id)
+        # Another worker may have finished the image without recording it
+        rendered = [path for path in pending if os.path.exists(path)]
+        if rendered:
+            await db_run(self._finish, [job_id for path in rendered for job_id in pending.pop(path)[1]], "done", None)
+        self._schedule(pending)
+
+    def _schedule(self, pending):
+        for path, (data, job_ids) in pending.items():
+            task = asyncio.create_task(self._run(data, path, job_ids))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, data, path, job_ids):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            await loop.run_in_executor(self.executor, render_qr, data, path)
+            qr_latency.observe(time.perf_counter() - start)
+            status, error = "done", None
+        except Exception as e:
+            print(f"QR job failed for {data}: {e}")
+            status, error = "failed", str(e)
+        await db_run(self._finish, job_ids, status, error)
+
+    def _finish(self, job_ids, status, error):
+        with db_pool.transaction() as conn:
+            conn.executemany(
+                "UPDATE qr_job SET status = ?, error = ? WHERE id = ?",
+                [(status, error, job_id) for job_id in job_ids]
+            )
+
+qr_jobs = QRJobQueue()
+
+def qr_job_status(job_id, path, status):
+    return {
+        "job_id": job_id,
+        "status": status,
+        "status_url": f"{BASE_URL}/qr/jobs/{job_id}",
+        "qr_image": f"{BASE_URL}/qrcodes/{os.path.basename(path)}"
+    }
 
 @app.post("/idcard/upload/")
 async def upload_id_card(
@@ -128,56 +2247,99 @@ async def upload_id_card(
 ):
     try:
         # Save ID card image
-        id_filename = f"{roll_number}_{file.filename}"
-        file_path = os.path.join("idcards", id_filename)
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-
-        # Generate QR code
-        qr_data = f"http://127.0.0.1:8000/idcard/view_secure/{roll_number}"
-        qr_filename = f"{roll_number}_qr.png"
-        qr_path = os.path.join("qrcodes", qr_filename)
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        img.save(qr_path)
-
-        # Hash password using SHA-256
-        password = sha256(password.encode()).hexdigest()
-
-        # Save to database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO student_id (name, roll_number, branch, year, college_name, college_contact, id_image_path, qr_path, password, time)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            name, roll_number, branch, year, college_name,college_contact,
-            file_path, qr_path, password, datetime.now().strftime("%d %b %Y %H:%M:%S")
-        ))
-        conn.commit()
-        conn.close()
+        async with stored_upload(file, "idcards") as (file_path, digest, _):
+            now = datetime.now()
+            qr_data = qr_payload(roll_number, name, int(now.timestamp()))
+
+            # Hash password using SHA-256
+            password = hashlib.sha256(password.encode()).hexdigest()
 
+            # Save to database
+            await db_run(db_execute, """
+                INSERT INTO student_id (name, roll_number, branch, year, college_name, college_contact, id_image_path, qr_path, password, time, time_epoch, qr_issued)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                name, roll_number, branch, year, college_name,college_contact,
+                file_path, qr_cache_path(qr_data), password, now.strftime(TIME_FORMAT), int(now.timestamp()), int(now.timestamp())
+            ))
+
+        # Queue QR code generation - the image shows up at qr_image once done
+        [(job_id, qr_path, qr_status)] = await qr_jobs.submit([qr_data])
+
+        job = qr_job_status(job_id, qr_path, qr_status)
         return {
             "message": "ID card uploaded successfully!",
             "qr_link": qr_data,
-            "qr_image": f"http://127.0.0.1:8000/qrcodes/{qr_filename}"
+            "qr_image": job["qr_image"],
+            "qr_job": job,
+            "image": image_job(digest)
         }
+    except HTTPException:
+        raise
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="Roll number already registered")
+    except Exception as e:
+        print(f"Error in upload_id_card: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/qr/jobs/{job_id}")
+def get_qr_job(job_id: str):
+    job = db_query("SELECT id, path, status, error FROM qr_job WHERE id = ?", (job_id,), one=True)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown QR job")
+    result = qr_job_status(job[0], job[1], job[2])
+    if job[3]:
+        result["error"] = job[3]
+    return result
+
+async def queue_card_qrs(cards, batch=None):
+    """Render QRs for (rowid, roll_number, name, issued) cards and point the rows at them."""
+    jobs = await qr_jobs.submit([qr_payload(roll, name, issued) for _, roll, name, issued in cards], batch)
+
+    def update_cards():
+        with db_pool.transaction() as conn:
+            conn.executemany(
+                "UPDATE student_id SET qr_path = ?, qr_issued = ? WHERE rowid = ?",
+                [(path, card[3], card[0]) for (_, path, _), card in zip(jobs, cards)]
+            )
+    await db_run(update_cards)
+    return jobs
+
+@app.post("/qr/regenerate/")
+async def regenerate_qr_codes(session: dict = Depends(require_staff)):
+    # Re-point every ID card QR at the current BASE_URL (e.g. after a domain move)
+    try:
+        students = await db_run(db_query, "SELECT rowid, roll_number, name, qr_issued, qr_path FROM student_id")
+        # Latest job per image - a failed or lost job leaves the card without one
+        unfinished = {path for path, status in await db_run(db_query, """
+            SELECT path, status FROM qr_job WHERE rowid IN (SELECT MAX(rowid) FROM qr_job GROUP BY path)
+        """) if status in ("pending", "failed")}
+        stale = [
+            card[:4] for card in students
+            if card[4] != qr_cache_path(qr_payload(*card[1:4])) or card[4] in unfinished or not os.path.exists(card[4])
+        ]
+        if not stale:
+            return {"queued": 0, "batch": None}
+
+        batch = uuid.uuid4().hex
+        jobs = await queue_card_qrs(stale, batch)
+        return {"queued": len(jobs), "batch": batch, "status_url": f"{BASE_URL}/qr/batches/{batch}"}
     except Exception as e:
-        print(f"Error in upload_id_card: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
-import hashlib
+        print(f"Error in regenerate_qr_codes: {e}")
+        raise HTTPException(status_code=500, detail="Regeneration failed")
+
+@app.get("/qr/batches/{batch}")
+def get_qr_batch(batch: str):
+    counts = dict(db_query("SELECT status, COUNT(*) FROM qr_job WHERE batch = ? GROUP BY status", (batch,)))
+    if not counts:
+        raise HTTPException(status_code=404, detail="Unknown QR batch")
+    return {"batch": batch, "total": sum(counts.values()), **{s: counts.get(s, 0) for s in ("pending", "done", "failed")}}
 
 @app.post("/idcard/view_secure/")
 def view_id_card_secure(roll_number: str = Form(...), password: str = Form(...)):
     try:
         password_2 = hashlib.sha256(password.strip().encode()).hexdigest()
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM student_id WHERE roll_number = ? AND password = ?", (roll_number, password_2))
-        student = cursor.fetchone()
-        conn.close()
+        student = db_query("SELECT * FROM student_id WHERE roll_number = ? COLLATE NOCASE AND password = ?", (roll_number, password_2), one=True)
     except Exception as e:
         print(f"DB error: {e}")
         raise HTTPException(status_code=500, detail="Database error")
@@ -185,7 +2347,7 @@ def view_id_card_secure(roll_number: str = Form(...), password: str = Form(...))
     if not student:
         raise HTTPException(status_code=401, detail="Invalid roll number or password")
 
-    return {
+    card = {
         "name": student[1],
         "roll_number": student[2],
         "branch": student[3],
@@ -193,136 +2355,533 @@ def view_id_card_secure(roll_number: str = Form(...), password: str = Form(...))
         "college_name": student[5],
         "college_contact": student[6]
     }
+    # The token carries the card, so /idcard/view/ needs no DB lookup or hash
+    token = issue_token(student[2], "idcard", name=student[1], card=card)
+    return {**card, **token_response(token)}
+
+@app.get("/idcard/view/")
+def view_id_card(session: dict = Depends(require_session)):
+    if session["role"] != "idcard":
+        raise HTTPException(status_code=403, detail="Not an ID card session")
+    return session["card"]
+
+
+# ========================================
+# SIGNED QR TOKENS
+# ========================================
+
+# In "signed" mode an ID card QR carries a compact HMAC-signed token
+# (roll number, issue time, expiry, name hash), so a gate can check a scan
+# in memory with no password form or database lookup. "link" keeps the old
+# /idcard/view_secure/{roll} URL.
+QR_MODE = setting("qr_mode", "signed")
+QR_TOKEN_TTL = setting("qr_token_ttl", 365 * 86400, int)  # seconds a card stays valid
+QR_REVOCATION_REFRESH = 30  # seconds between revocation list reloads
+QR_BATCH_LIMIT = 5000       # scans per batch verification request
+QR_CLOCK_SKEW = 60          # seconds a gate clock may run behind the server
+
+QR_TOKEN_VERSION = 1
+QR_SIGNATURE_BYTES = 12     # truncated HMAC-SHA256 keeps the QR small
+_QR_HEADER = struct.Struct(">BII6s")  # version, issued, expires, name hash
+
+# Separate key so a session token can never pass as a QR token or vice versa
+QR_KEY = hmac.new(SECRET_KEY.encode(), b"xcampus-qr-token", hashlib.sha256).digest()
+
+qr_verifications = Counter("xcampus_qr_verifications_total", "ID card QR tokens checked", ("result",))
+
+def name_hash(name):
+    return hashlib.sha256(" ".join((name or "").lower().split()).encode()).digest()[:6]
+
+def issue_qr_token(roll_number, name, issued, ttl=QR_TOKEN_TTL):
+    """Deterministic for the same card, so regenerating a QR reuses its image."""
+    payload = _QR_HEADER.pack(QR_TOKEN_VERSION, issued, issued + ttl, name_hash(name)) + roll_number.encode()
+    signature = hmac.new(QR_KEY, payload, hashlib.sha256).digest()[:QR_SIGNATURE_BYTES]
+    return _b64encode(payload + signature)
+
+def decode_qr_token(token):
+    """Claims of a correctly signed token, else None. Expiry is checked by the caller."""
+    try:
+        raw = _b64decode(token)
+    except Exception:
+        return None
+    payload, signature = raw[:-QR_SIGNATURE_BYTES], raw[-QR_SIGNATURE_BYTES:]
+    if len(payload) <= _QR_HEADER.size:
+        return None
+    expected = hmac.new(QR_KEY, payload, hashlib.sha256).digest()[:QR_SIGNATURE_BYTES]
+    if not hmac.compare_digest(signature, expected):
+        return None
+    version, issued, expires, hashed_name = _QR_HEADER.unpack_from(payload)
+    if version != QR_TOKEN_VERSION:
+        return None
+    try:
+        roll_number = payload[_QR_HEADER.size:].decode()
+    except UnicodeDecodeError:
+        return None
+    return {"roll_number": roll_number, "issued": issued, "expires": expires, "name_hash": hashed_name}
+
+class QRVerifier:
+    """Checks QR tokens in memory against an in-process copy of qr_revocation.
+
+    Revoking a roll number invalidates every token issued for it up to that
+    moment; the list is append-only and reloaded incrementally (rows after
+    the last seen id) at most every QR_REVOCATION_REFRESH seconds, so other
+    workers' revocations apply within that delay.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.revoked = {}   # lower-cased roll number -> latest revoked_at
+        self.last_id = 0
+        self.last_refresh = 0
+        self.stats = {"verified": 0, "invalid": 0, "expired": 0, "revoked": 0}
+
+    def init_db(self):
+        columns = [row[1] for row in db_query("PRAGMA table_info(student_id)")]
+        if "qr_issued" not in columns:
+            db_execute("ALTER TABLE student_id ADD COLUMN qr_issued INTEGER")
+        db_execute("UPDATE student_id SET qr_issued = COALESCE(time_epoch, 0) WHERE qr_issued IS NULL")
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS qr_revocation (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                roll_number TEXT NOT NULL,
+                revoked_at INTEGER NOT NULL,
+                reason TEXT,
+                time TEXT
+            )
+        """)
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS gate_scan (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device TEXT,
+                roll_number TEXT,
+                scanned_at INTEGER,
+                result TEXT NOT NULL,
+                time TEXT
+            )
+        """)
+        db_execute("CREATE INDEX IF NOT EXISTS idx_gate_scan_roll ON gate_scan (roll_number, scanned_at)")
+
+    def refresh(self, force=False):
+        if not force and time.monotonic() - self.last_refresh < QR_REVOCATION_REFRESH:
+            return
+        rows = db_query(
+            "SELECT id, roll_number, revoked_at FROM qr_revocation WHERE id > ? ORDER BY id", (self.last_id,)
+        )
+        with self._lock:
+            for row_id, roll_number, revoked_at in rows:
+                key = roll_number.lower()
+                self.revoked[key] = max(revoked_at, self.revoked.get(key, 0))
+                self.last_id = max(self.last_id, row_id)
+            self.last_refresh = time.monotonic()
+
+    def check(self, token, at=None, name=None):
+        """Verdict for one scan. `at` is when it was scanned (default: now)."""
+        self.refresh()
+        claims = decode_qr_token(token)
+        if not claims:
+            result = {"valid": False, "reason": "invalid"}
+        else:
+            at = at or int(time.time())
+            revoked_at = self.revoked.get(claims["roll_number"].lower(), 0)
+            if claims["issued"] <= revoked_at <= at:
+                reason = "revoked"
+            elif not claims["issued"] - QR_CLOCK_SKEW <= at < claims["expires"]:
+                reason = "expired"
+            else:
+                reason = None
+            result = {
+                "valid": reason is None,
+                "reason": reason,
+                "roll_number": claims["roll_number"],
+                "expires": claims["expires"],
+            }
+            if name is not None:
+                result["name_match"] = hmac.compare_digest(name_hash(name), claims["name_hash"])
+        key = "verified" if result["valid"] else result["reason"]
+        self.stats[key] += 1
+        qr_verifications.inc(result=key)
+        return result
+
+    def revoke(self, roll_number, reason=None):
+        revoked_at = int(time.time())
+        db_execute(
+            "INSERT INTO qr_revocation (roll_number, revoked_at, reason, time) VALUES (?, ?, ?, ?)",
+            (roll_number, revoked_at, reason, datetime.now().strftime(TIME_FORMAT))
+        )
+        self.refresh(force=True)
+        return revoked_at
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, mode=QR_MODE, revoked_rolls=len(self.revoked))
+
+qr_verifier = QRVerifier()
+
+class GateScan(BaseModel):
+    token: str
+    scanned_at: Optional[int] = None  # epoch seconds on the device; default: now
 
+class GateScanLog(BaseModel):
+    device: str
+    scans: list[GateScan]
+
+@app.get("/idcard/verify/{token}")
+def verify_id_card(token: str, name: str = None):
+    """What a gate scanner (or a phone following the QR link) calls - no DB lookup."""
+    return qr_verifier.check(token, name=name)
+
+@app.post("/idcard/verify/batch")
+def verify_id_card_batch(log: GateScanLog, session: dict = Depends(require_staff)):
+    # Offline gate devices upload their scan logs when they reconnect; each
+    # scan is judged as of the time it happened and the log is stored in one write
+    if len(log.scans) > QR_BATCH_LIMIT:
+        raise HTTPException(status_code=413, detail=f"At most {QR_BATCH_LIMIT} scans per batch")
+    try:
+        qr_verifier.refresh(force=True)
+        now = datetime.now().strftime(TIME_FORMAT)
+        results = []
+        rows = []
+        for scan in log.scans:
+            # One timestamp for both, so the stored scan matches the verdict
+            scanned_at = scan.scanned_at if scan.scanned_at is not None else int(time.time())
+            result = qr_verifier.check(scan.token, at=scanned_at)
+            results.append(result)
+            rows.append((
+                log.device, result.get("roll_number"), scanned_at,
+                "valid" if result["valid"] else result["reason"], now
+            ))
+        with db_pool.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO gate_scan (device, roll_number, scanned_at, result, time) VALUES (?, ?, ?, ?, ?)", rows
+            )
+        return {
+            "device": log.device,
+            "scans": len(results),
+            "valid": sum(1 for r in results if r["valid"]),
+            "results": results
+        }
+    except Exception as e:
+        print(f"Error in verify_id_card_batch: {e}")
+        raise HTTPException(status_code=500, detail="Batch verification failed")
+
+@app.post("/idcard/revoke/")
+async def revoke_id_card(
+    roll_number: str = Form(...),
+    reason: str = Form(None),
+    reissue: bool = Form(True),
+    session: dict = Depends(require_staff)
+):
+    """Invalidate a card's QR (lost, stolen, left college) and optionally issue a new one."""
+    try:
+        card = await db_run(
+            db_query, "SELECT rowid, roll_number, name FROM student_id WHERE roll_number = ? COLLATE NOCASE",
+            (roll_number,), one=True
+        )
+        if not card:
+            raise HTTPException(status_code=404, detail="Unknown roll number")
+        revoked_at = await db_run(qr_verifier.revoke, card[1], reason)
+        response = {"roll_number": card[1], "revoked_at": revoked_at}
+        if reissue:
+            # Issued strictly after the revocation so the new token is not caught by it
+            [(job_id, path, status)] = await queue_card_qrs([(card[0], card[1], card[2], revoked_at + 1)])
+            response["qr_job"] = qr_job_status(job_id, path, status)
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in revoke_id_card: {e}")
+        raise HTTPException(status_code=500, detail="Revocation failed")
 
 # ========================================
 # CAREER GUIDANCE ENDPOINTS
 # ========================================
 
+# Built once at import instead of on every request
+CAREER_FIELDS = {
+    "coding": "Software Development / Backend Engineering",
+    "design": "UI/UX Design / Product Design", 
+    "communication": "Marketing / Public Relations / HR",
+    "data analysis": "Data Science / Business Analytics",
+    "machine learning": "AI Research / ML Engineering",
+    "video editing": "Content Creation / Media Production",
+    "finance": "Investment Banking / Financial Analysis"
+}
+
 @app.post("/career/suggest/")
 def suggest_career(skill: str = Form(...)):
-    skill_mapping = {
-        "coding": "Software Development / Backend Engineering",
-        "design": "UI/UX Design / Product Design", 
-        "communication": "Marketing / Public Relations / HR",
-        "data analysis": "Data Science / Business Analytics",
-        "machine learning": "AI Research / ML Engineering",
-        "video editing": "Content Creation / Media Production",
-        "finance": "Investment Banking / Financial Analysis"
-    }
-    
-    recommended_field = skill_mapping.get(skill.lower(), "General Technology Field")
+    recommended_field = CAREER_FIELDS.get(" ".join(skill.lower().split()), "General Technology Field")
     return {"recommended_field": recommended_field}
 
 # ========================================
 # COLLEGE RECOMMENDATION ENDPOINTS
 # ========================================
 
+COLLEGE_CATALOG_PATH = setting(
+    "college_catalog",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "colleges.json")
+)
+COLLEGE_RESULTS = 5
+COLLEGE_BATCH_LIMIT = 1000
+
+def normalize_key(text):
+    return " ".join((text or "").lower().split())
+
+class CollegeCatalog:
+    """College catalog from colleges.json, indexed by (skill, tier, city).
+
+    Each college may set its own "cutoff"; otherwise its tier's cutoff
+    applies. Results are banded against the cutoff: "safe" a margin above
+    it, "likely" at or just above it, "reach" a little below it.
+    """
+
+    def __init__(self, path=COLLEGE_CATALOG_PATH):
+        self.path = path
+        self.tiers = {}
+        self.bands = {}
+        self.city_aliases = {}
+        self.index = {}
+        self.min_cutoff = 0
+        # Cached per instance so the cache goes away with the catalog
+        self.recommend = lru_cache(maxsize=4096)(self._recommend)
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        config = json.loads(raw)
+        tiers = config["tiers"]
+        index = {}
+        for college in config["colleges"]:
+            tier = tiers[college["tier"]]
+            entry = {
+                "college": college["name"],
+                "college_type": tier["label"],
+                "city": college["city"],
+                "cutoff": college.get("cutoff", tier["cutoff"]),
+                "rank": tier["rank"],
+            }
+            key = (normalize_key(college["skill"]), college["tier"], normalize_key(college["city"]))
+            index.setdefault(key, []).append(entry)
+        for entries in index.values():
+            entries.sort(key=lambda e: (-e["cutoff"], e["college"]))
+
+        self.tiers = tiers
+        self.bands = config.get("bands", {"safe": 5, "reach": 5})
+        self.city_aliases = {normalize_key(k): normalize_key(v) for k, v in config.get("city_aliases", {}).items()}
+        self.index = index
+        self.min_cutoff = min(t["cutoff"] for t in tiers.values())
+        self.recommend.cache_clear()
+        response_cache.invalidate_if_changed("colleges", hashlib.sha256(raw).hexdigest())
+
+    def band(self, percentage, cutoff):
+        if percentage >= cutoff + self.bands["safe"]:
+            return "safe"
+        if percentage >= cutoff:
+            return "likely"
+        if percentage >= cutoff - self.bands["reach"]:
+            return "reach"
+        return None
+
+    def _recommend(self, percentage, skill, city, limit=COLLEGE_RESULTS):
+        """Ranked colleges for one (percentage, skill, city); cached per tuple."""
+        skill = normalize_key(skill)
+        city = normalize_key(city)
+        city = self.city_aliases.get(city, city)
+        results = []
+        for tier in self.tiers:
+            for entry in self.index.get((skill, tier, city), ()):
+                band = self.band(percentage, entry["cutoff"])
+                if band:
+                    results.append(dict(entry, band=band))
+        # Attainable colleges first, best tier first, most selective first
+        results.sort(key=lambda e: (e["band"] == "reach", e["rank"], -e["cutoff"], e["college"]))
+        return tuple(results[:limit])
+
+    def response(self, percentage, skill, city, limit=COLLEGE_RESULTS):
+        if percentage < self.min_cutoff:
+            return {"message": "Sorry, percentage too low for recommendations."}
+        results = [{k: v for k, v in r.items() if k != "rank"} for r in self.recommend(percentage, skill, city, limit)]
+        if not results or results[0]["band"] == "reach":
+            return {"message": "No matching college found for this combination.", "results": results}
+        return {
+            "college_type": results[0]["college_type"],
+            "recommended_college": results[0]["college"],
+            "results": results
+        }
+
+college_catalog = CollegeCatalog()
+
 @app.post("/college/recommend/")
 def recommend_college(
+    request: Request,
     percentage: int = Form(...),
     skill: str = Form(...),
     city: str = Form(...)
 ):
-    # Define cutoffs
-    govt_cutoff = 85
-    private_cutoff = 50
-    
-    if percentage < private_cutoff:
-        return {"message": "Sorry, percentage too low for recommendations."}
-    
-    college_type = "govt" if percentage >= govt_cutoff else "private"
-    
-    # College mapping
-    colleges = {
-        "coding": {
-            "govt": {
-                "Vadodara": "MSU Technology Campus",
-                "Ahmedabad": "LD Engineering College",
-                "Surat": "Government Engineering College",
-                "Rajkot": "Government Engineering College Rajkot",
-                "Pune": "College of Engineering Pune",
-                "Mumbai": "VJTI Mumbai",
-                "Delhi": "NSUT Delhi",
-                "Bangalore": "University Visvesvaraya College of Engineering",
-                "Hyderabad": "Osmania University College of Engineering",
-                "Chennai": "College of Engineering Guindy"
-            },
-            "private": {
-                "Vadodara": "Parul University",
-                "Ahmedabad": "Nirma University",
-                "Surat": "Sardar Vallabhbhai National Institute of Technology",
-                "Rajkot": "Marwadi University",
-                "Pune": "MIT World Peace University",
-                "Mumbai": "NMIMS University",
-                "Delhi": "Amity University Delhi",
-                "Bangalore": "PES University",
-                "Hyderabad": "Vardhaman College of Engineering",
-                "Chennai": "SRM Institute of Science and Technology"
-            }
-        },
-        "design": {
-            "govt": {
-                "Vadodara": "MSU Faculty of Fine Arts",
-                "Ahmedabad": "CEPT University",
-                "Surat": "Veer Narmad South Gujarat University",
-                "Rajkot": "Saurashtra University",
-                "Pune": "College of Engineering Pune - Design",
-                "Mumbai": "Sir JJ School of Art",
-                "Delhi": "NIFT Delhi",
-                "Bangalore": "National Institute of Design",
-                "Hyderabad": "JNAFAU",
-                "Chennai": "Government College of Fine Arts"
-            },
-            "private": {
-                "Vadodara": "Parul Institute of Design",
-                "Ahmedabad": "Anant National University",
-                "Surat": "AURO University",
-                "Rajkot": "RK University",
-                "Pune": "Symbiosis Institute of Design",
-                "Mumbai": "Indian School of Design and Innovation",
-                "Delhi": "Pearl Academy",
-                "Bangalore": "Srishti Institute of Art, Design and Technology",
-                "Hyderabad": "ICAT Design and Media College",
-                "Chennai": "LISAA School of Design"
-            }
-        },
-        "finance": {
-            "govt": {
-                "Vadodara": "MSU Faculty of Commerce",
-                "Ahmedabad": "Gujarat University",
-                "Surat": "Veer Narmad South Gujarat University",
-                "Rajkot": "Saurashtra University",
-                "Pune": "Brihan Maharashtra College of Commerce",
-                "Mumbai": "Sydenham College of Commerce and Economics",
-                "Delhi": "Shri Ram College of Commerce",
-                "Bangalore": "Bangalore University",
-                "Hyderabad": "Osmania University",
-                "Chennai": "University of Madras"
-            },
-            "private": {
-                "Vadodara": "Navrachana University",
-                "Ahmedabad": "GLS University",
-                "Surat": "AURO University",
-                "Rajkot": "Atmiya University",
-                "Pune": "MIT World Peace University",
-                "Mumbai": "NMIMS School of Business Management",
-                "Delhi": "Amity Business School",
-                "Bangalore": "Christ University",
-                "Hyderabad": "ICFAI Business School",
-                "Chennai": "VIT Business School"
-            }
-        }
-    }
-    
-    try:
-        recommended_college = colleges[skill.lower()][college_type][city]
-        return {
-            "college_type": "Government" if college_type == "govt" else "Private",
-            "recommended_college": recommended_college
-        }
-    except KeyError:
-        return {"message": "No matching college found for this combination."}
+    return response_cache.serve(
+        request, "colleges", f"{percentage}|{normalize_key(skill)}|{normalize_key(city)}",
+        lambda: college_catalog.response(percentage, skill, city)
+    )
+
+class CollegeQuery(BaseModel):
+    percentage: int
+    skill: str
+    city: str
+    name: str = None
+
+@app.post("/college/recommend/batch")
+def recommend_college_batch(students: list[CollegeQuery], limit: int = Query(COLLEGE_RESULTS, ge=1, le=20)):
+    # Counselling day: a whole class in one call; repeated inputs hit the cache
+    if len(students) > COLLEGE_BATCH_LIMIT:
+        raise HTTPException(status_code=413, detail=f"At most {COLLEGE_BATCH_LIMIT} students per batch")
+    return [
+        {"name": s.name, **college_catalog.response(s.percentage, s.skill, s.city, limit)}
+        for s in students
+    ]
+
+# ========================================
+# PASSWORD HASHING
+# ========================================
+
+# bcrypt is deliberately slow; it runs on its own threads (bcrypt releases the
+# GIL) so a login burst can't starve the event loop or the shared threadpool.
+HASH_WORKERS = setting("hash_workers", max(2, (os.cpu_count() or 2) // 2), int)
+HASH_QUEUE_LIMIT = setting("hash_queue_limit", HASH_WORKERS * 8, int)
+HASH_RETRY_AFTER = 2  # seconds suggested to clients when the queue is full
+
+LOGIN_MAX_FAILURES = 5       # failed logins per account ...
+LOGIN_FAILURE_WINDOW = 900   # ... within this many seconds ...
+LOGIN_LOCKOUT_SECONDS = 300  # ... lock the account for this long
+
+class PasswordHasher:
+    """Bounded bcrypt executor with admission control and latency metrics."""
+
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.executor = None
+        self.outstanding = 0
+        self.latencies = deque(maxlen=1000)
+        self.stats = {"hashes": 0, "verifies": 0, "rejected": 0, "max_outstanding": 0}
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="bcrypt")
+        # Import passlib/bcrypt in the background instead of on the first login
+        self.executor.submit(get_pwd_context)
+
+    def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+
+    async def _run(self, op, func, *args):
+        # Only touched from the event loop, so no lock is needed
+        if self.outstanding >= self.queue_limit:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please retry shortly",
+                headers={"Retry-After": str(HASH_RETRY_AFTER)}
+            )
+        self.outstanding += 1
+        self.stats["max_outstanding"] = max(self.stats["max_outstanding"], self.outstanding)
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.outstanding -= 1
+            self.latencies.append(time.perf_counter() - start)
+            hash_latency.observe(time.perf_counter() - start, op=op)
+
+    async def hash(self, password):
+        self.stats["hashes"] += 1
+        return await self._run("hash", get_pwd_context().hash, password)
+
+    async def verify(self, password, hashed):
+        self.stats["verifies"] += 1
+        return await self._run("verify", get_pwd_context().verify, password, hashed)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+        return dict(
+            self.stats,
+            workers=self.workers,
+            queue_limit=self.queue_limit,
+            outstanding=self.outstanding,
+            latency_ms={"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)}
+        )
+
+password_hasher = PasswordHasher()
+
+class LoginLimiter:
+    """Per-account failed-login counters with temporary lockout.
+
+    Kept in the login_failure table rather than in memory so every worker
+    counts against the same budget - otherwise each extra worker would
+    allow another LOGIN_MAX_FAILURES guesses.
+    """
+
+    def init_db(self):
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS login_failure (
+                account TEXT PRIMARY KEY,
+                failures INTEGER NOT NULL,
+                window_start REAL NOT NULL,
+                locked_until REAL
+            )
+        """)
+
+    def check(self, key):
+        """Raise 429 while the account is locked (blocking)."""
+        now = time.time()
+        row = db_query("SELECT locked_until FROM login_failure WHERE account = ?", (self._account(key),), one=True)
+        if row and row[0] and row[0] > now:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many failed logins, try again later",
+                headers={"Retry-After": str(int(row[0] - now) + 1)}
+            )
+
+    def failed(self, key):
+        now = time.time()
+        with db_pool.transaction() as conn:
+            # A new window starts once the old one has passed or a lockout ended
+            failures = conn.execute("""
+                INSERT INTO login_failure (account, failures, window_start) VALUES (?, 1, ?)
+                ON CONFLICT(account) DO UPDATE SET
+                    failures = CASE WHEN window_start < ? OR locked_until IS NOT NULL THEN 1 ELSE failures + 1 END,
+                    window_start = CASE WHEN window_start < ? OR locked_until IS NOT NULL THEN ? ELSE window_start END,
+                    locked_until = NULL
+                RETURNING failures
+            """, (self._account(key), now, now - LOGIN_FAILURE_WINDOW, now - LOGIN_FAILURE_WINDOW, now)).fetchone()[0]
+            if failures >= LOGIN_MAX_FAILURES:
+                conn.execute(
+                    "UPDATE login_failure SET locked_until = ? WHERE account = ?",
+                    (now + LOGIN_LOCKOUT_SECONDS, self._account(key))
+                )
+            if failures == 1:
+                self._prune(conn, now)
+
+    def succeeded(self, key):
+        db_execute("DELETE FROM login_failure WHERE account = ?", (self._account(key),))
+
+    def _account(self, key):
+        return ":".join(key)
+
+    def _prune(self, conn, now):
+        conn.execute(
+            "DELETE FROM login_failure WHERE window_start < ? AND (locked_until IS NULL OR locked_until < ?)",
+            (now - LOGIN_FAILURE_WINDOW, now)
+        )
+
+    def snapshot(self):
+        now = time.time()
+        tracked, locked = db_query(
+            "SELECT COUNT(*), COALESCE(SUM(locked_until > ?), 0) FROM login_failure", (now,), one=True
+        )
+        return {"tracked_accounts": tracked, "locked_accounts": locked}
+
+login_limiter = LoginLimiter()
 
 # ========================================
 # STUDENT REGISTRATION ENDPOINTS
@@ -340,45 +2899,45 @@ async def register_student(
 ):
     try:
         # Save student photo
-        photo_filename = f"student_{email}_{photo.filename}"
-        photo_path = os.path.join("student_photos", photo_filename)
-        with open(photo_path, "wb") as f:
-            f.write(await photo.read())
-
-        # Hash password
-        hashed_password = pwd_context.hash(password)
-
-        # Save to database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO student_register (name, email, phone, branch, year, password_hash, photo_path, time)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            name, email, phone, branch, year, hashed_password, photo_path,
-            datetime.now().strftime("%d %b %Y %H:%M:%S")
-        ))
-        conn.commit()
-        conn.close()
-
-        return {"message": "Student registered successfully!"}
+        async with stored_upload(photo, "student_photos") as (photo_path, digest, _):
+            # Hash password
+            hashed_password = await password_hasher.hash(password)
+
+            # Save to database
+            now = datetime.now()
+            await db_run(db_execute, """
+                INSERT INTO student_register (name, email, phone, branch, year, password_hash, photo_path, time, time_epoch)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                name, email, phone, branch, year, hashed_password, photo_path,
+                now.strftime(TIME_FORMAT), int(now.timestamp())
+            ))
+
+        return {"message": "Student registered successfully!", "image": image_job(digest)}
+    except HTTPException:
+        raise
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="Email already registered")
     except Exception as e:
         print(f"Error in register_student: {e}")
         raise HTTPException(status_code=500, detail="Registration failed")
 
 @app.post("/student/login/")
-def login_student(email: str = Form(...), password: str = Form(...)):
+async def login_student(email: str = Form(...), password: str = Form(...)):
+    account = ("student", email.strip().lower())
+    await db_run(login_limiter.check, account)
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, password_hash FROM student_register WHERE email = ?", (email,))
-        student = cursor.fetchone()
-        conn.close()
+        student = await db_run(db_query, "SELECT name, password_hash FROM student_register WHERE email = ? COLLATE NOCASE", (email,), one=True)
         
-        if not student or not pwd_context.verify(password, student[1]):
+        if not student or not await password_hasher.verify(password, student[1]):
+            await db_run(login_limiter.failed, account)
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
-        return {"message": f"Welcome back, {student[0]}!"}
+        await db_run(login_limiter.succeeded, account)
+        token = issue_token(email.strip().lower(), "student", name=student[0])
+        return {"message": f"Welcome back, {student[0]}!", **token_response(token)}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in login_student: {e}")
         raise HTTPException(status_code=500, detail="Login failed")
@@ -399,53 +2958,538 @@ async def register_staff(
 ):
     try:
         # Save staff photo
-        photo_filename = f"staff_{email}_{photo.filename}"
-        photo_path = os.path.join("staff_photos", photo_filename)
-        with open(photo_path, "wb") as f:
-            f.write(await photo.read())
-
-        # Hash password
-        hashed_password = pwd_context.hash(password)
-
-        # Save to database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO staff_register (name, email, phone, department, designation, password_hash, photo_path, time)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            name, email, phone, department, designation, hashed_password, photo_path,
-            datetime.now().strftime("%d %b %Y %H:%M:%S")
-        ))
-        conn.commit()
-        conn.close()
-
-        return {"message": "Staff registered successfully!"}
+        async with stored_upload(photo, "staff_photos") as (photo_path, digest, _):
+            # Hash password
+            hashed_password = await password_hasher.hash(password)
+
+            # Save to database
+            now = datetime.now()
+            await db_run(db_execute, """
+                INSERT INTO staff_register (name, email, phone, department, designation, password_hash, photo_path, time, time_epoch)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                name, email, phone, department, designation, hashed_password, photo_path,
+                now.strftime(TIME_FORMAT), int(now.timestamp())
+            ))
+
+        return {"message": "Staff registered successfully!", "image": image_job(digest)}
+    except HTTPException:
+        raise
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="Email already registered")
     except Exception as e:
         print(f"Error in register_staff: {e}")
         raise HTTPException(status_code=500, detail="Registration failed")
 
 @app.post("/staff/login/")
-def login_staff(email: str = Form(...), password: str = Form(...)):
+async def login_staff(email: str = Form(...), password: str = Form(...)):
+    account = ("staff", email.strip().lower())
+    await db_run(login_limiter.check, account)
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, password_hash FROM staff_register WHERE email = ?", (email,))
-        staff = cursor.fetchone()
-        conn.close()
+        staff = await db_run(db_query, "SELECT name, password_hash FROM staff_register WHERE email = ? COLLATE NOCASE", (email,), one=True)
         
-        if not staff or not pwd_context.verify(password, staff[1]):
+        if not staff or not await password_hasher.verify(password, staff[1]):
+            await db_run(login_limiter.failed, account)
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
-        return {"message": f"Welcome back, {staff[0]}!"}
+        await db_run(login_limiter.succeeded, account)
+        token = issue_token(email.strip().lower(), "staff", name=staff[0])
+        return {"message": f"Welcome back, {staff[0]}!", **token_response(token)}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in login_staff: {e}")
         raise HTTPException(status_code=500, detail="Login failed")
 
+@app.post("/staff/approve/")
+async def approve_staff(
+    email: str = Form(...),
+    approved: bool = Form(True),
+    session: dict = Depends(require_staff)
+):
+    if await db_run(set_staff_approval, email, approved):
+        return {"email": email.strip().lower(), "approved": approved}
+    raise HTTPException(status_code=404, detail="Unknown staff email")
+
+# ========================================
+# BULK ROSTER IMPORT / EXPORT
+# ========================================
+
+ROSTER_BATCH_SIZE = 500    # rows per transaction (also the export page size)
+ROSTER_MAX_ERRORS = 1000   # per-row errors reported back; the rest are only counted
+# bcrypt releases the GIL, so a thread per core hashes in parallel without
+# the pickling and spawn cost of a process pool
+BULK_HASH_WORKERS = setting("bulk_hash_workers", os.cpu_count() or 2, int)
+
+# What each roster maps to. "key" must be unique per row; "photo" is the
+# column holding the stored path and the upload kind used for its limits.
+ROSTERS = {
+    "students": {
+        "table": "student_register",
+        "columns": ["name", "email", "phone", "branch", "year"],
+        "key": "email",
+        "password": ("password_hash", "bcrypt"),
+        "photo": ("photo_path", "student_photos"),
+    },
+    "staff": {
+        "table": "staff_register",
+        "columns": ["name", "email", "phone", "department", "designation"],
+        "key": "email",
+        "password": ("password_hash", "bcrypt"),
+        "photo": ("photo_path", "staff_photos"),
+    },
+    "idcards": {
+        "table": "student_id",
+        "columns": ["name", "roll_number", "branch", "year", "college_name", "college_contact"],
+        "key": "roll_number",
+        # Same scheme as /idcard/upload/ so view_secure keeps working
+        "password": ("password", "sha256"),
+        "photo": ("id_image_path", "idcards"),
+    },
+}
+
+# One import at a time - each one already uses every core for hashing
+roster_import_lock = threading.Lock()
+
+def roster_spec(kind):
+    spec = ROSTERS.get(kind)
+    if not spec:
+        raise HTTPException(status_code=404, detail=f"Unknown roster (choose from {', '.join(ROSTERS)})")
+    return spec
+
+def roster_format(format, filename=""):
+    format = (format or os.path.splitext(filename or "")[1].lstrip(".")).lower()
+    if format not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="Roster format must be csv or jsonl")
+    return format
+
+def read_roster_rows(fileobj, format):
+    """Yield (line number, row dict, error) without loading the whole file."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if format == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_num, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_num, None, "Each line must be a JSON object"
+            continue
+        yield line_num, row, None
+
+def validate_roster_row(spec, row):
+    """Return (record, error): the cleaned field dict, or why the row is rejected."""
+    record = {}
+    for column in spec["columns"] + ["password", "photo"]:
+        value = row.get(column)
+        record[column] = "" if value is None else str(value).strip()
+    missing = [c for c in spec["columns"] + ["password"] if not record[c]]
+    if missing:
+        return None, f"Missing {', '.join(missing)}"
+    if spec["key"] == "email" and "@" not in record["email"]:
+        return None, "Invalid email"
+    return record, None
+
+def store_zip_photo(archive, info, kind):
+    """Copy one zip member into the media store (blocking). Returns (path, digest)."""
+    max_bytes = UPLOAD_LIMITS[kind]
+    if info.file_size > max_bytes:
+        raise ValueError(f"Photo too large (max {max_bytes // (1024 * 1024)} MB)")
+    hasher = hashlib.sha256()
+    size = 0
+    ext = None
+    tmp = _open_temp()
+    try:
+        with archive.open(info) as src:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = sniff_image(chunk) or ""
+                if not ext:
+                    raise ValueError(UNSUPPORTED_IMAGE)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"Photo too large (max {max_bytes // (1024 * 1024)} MB)")
+                _write_chunk(tmp, hasher, chunk)
+        if not ext:
+            raise ValueError(UNSUPPORTED_IMAGE)
+        _finish_temp(tmp)
+        digest = hasher.hexdigest()
+        path = media_store.ingest(tmp.name, digest, size, ext)
+    except BaseException:
+        _discard_temp(tmp)
+        raise
+    upload_count.inc(kind=kind)
+    upload_bytes.inc(size, kind=kind)
+    return path, digest
+
+class RosterImport:
+    """Validates, hashes and inserts roster rows in batches (blocking - run in a thread)."""
+
+    def __init__(self, spec, photos=None, dry_run=False):
+        self.spec = spec
+        self.photos = photos
+        # Zip entries are matched by file name, wherever they sit in the archive
+        self.photo_index = {}
+        if photos:
+            for info in photos.infolist():
+                if not info.is_dir():
+                    self.photo_index[os.path.basename(info.filename)] = info
+        self.dry_run = dry_run
+        self.seen = set()
+        self.keys = []   # unique keys of inserted rows, in order
+        self.report = {"rows": 0, "imported": 0, "failed": 0, "errors": []}
+
+    def fail(self, line, error):
+        self.report["failed"] += 1
+        if len(self.report["errors"]) < ROSTER_MAX_ERRORS:
+            self.report["errors"].append({"line": line, "error": error})
+
+    def run(self, rows):
+        batch = []
+        with ThreadPoolExecutor(BULK_HASH_WORKERS, thread_name_prefix="bulk-bcrypt") as self.hasher:
+            for line, row, error in rows:
+                self.report["rows"] += 1
+                record = None
+                if error is None:
+                    record, error = validate_roster_row(self.spec, row)
+                if error is None:
+                    key = record[self.spec["key"]].lower()
+                    if key in self.seen:
+                        error = f"Duplicate {self.spec['key']} in file"
+                    self.seen.add(key)
+                if error:
+                    self.fail(line, error)
+                    continue
+                batch.append((line, record))
+                if len(batch) >= ROSTER_BATCH_SIZE:
+                    self.flush(batch)
+                    batch = []
+            if batch:
+                self.flush(batch)
+        return self.report
+
+    def flush(self, batch):
+        spec = self.spec
+        key = spec["key"]
+
+        # Rows that already exist in the database
+        keys = [record[key] for _, record in batch]
+        placeholders = ",".join("?" * len(keys))
+        existing = {
+            row[0].lower() for row in db_query(
+                f"SELECT {key} FROM {spec['table']} WHERE {key} COLLATE NOCASE IN ({placeholders})", keys
+            ) if row[0]
+        }
+        accepted = []
+        for line, record in batch:
+            if record[key].lower() in existing:
+                self.fail(line, f"{key} already registered")
+                continue
+            info = None
+            if record["photo"]:
+                info = self.photo_index.get(os.path.basename(record["photo"].replace("\\", "/")))
+                if info is None:
+                    self.fail(line, f"Photo {record['photo']} not found in archive")
+                    continue
+            accepted.append((line, record, info))
+
+        if self.dry_run:
+            self.report["imported"] += len(accepted)
+            return
+
+        stored = []
+        digests = {}  # line -> photo digest, for rows not yet committed
+        try:
+            for line, record, info in accepted:
+                path = None
+                if info:
+                    try:
+                        path, digest = store_zip_photo(self.photos, info, spec["photo"][1])
+                    except Exception as e:
+                        self.fail(line, f"Photo rejected: {e}")
+                        continue
+                    digests[line] = digest
+                stored.append((line, record, path))
+
+            passwords = [record["password"] for _, record, _ in stored]
+            if spec["password"][1] == "bcrypt":
+                hashes = list(self.hasher.map(get_pwd_context().hash, passwords))
+            else:
+                hashes = [hashlib.sha256(p.encode()).hexdigest() for p in passwords]
+
+            now = datetime.now()
+            columns = spec["columns"] + [spec["password"][0], spec["photo"][0], "time", "time_epoch"]
+            sql = f"INSERT INTO {spec['table']} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            rows = [
+                (line, record, [record[c] for c in spec["columns"]] + [hashed, path, now.strftime(TIME_FORMAT), int(now.timestamp())])
+                for (line, record, path), hashed in zip(stored, hashes)
+            ]
+            try:
+                with db_pool.transaction() as conn:
+                    conn.executemany(sql, [values for _, _, values in rows])
+                inserted = rows
+                digests.clear()
+            except sqlite3.IntegrityError:
+                # Registered by someone else since the check above - find out
+                # which rows, one transaction each
+                inserted = []
+                for line, record, values in rows:
+                    try:
+                        with db_pool.transaction() as conn:
+                            conn.execute(sql, values)
+                    except sqlite3.IntegrityError:
+                        self.fail(line, f"{key} already registered")
+                        continue
+                    digests.pop(line, None)
+                    inserted.append((line, record, values))
+        finally:
+            # Photos of rows that were never written are referenced by nothing
+            for digest in digests.values():
+                media_store.release(digest)
+        self.report["imported"] += len(inserted)
+        self.keys.extend(record[key] for _, record, _ in inserted)
+
+@app.post("/roster/{kind}/import")
+async def import_roster(
+    kind: str,
+    roster: UploadFile = File(...),
+    photos: UploadFile = File(None),
+    format: str = Form(None),
+    dry_run: bool = Form(False),
+    session: dict = Depends(require_staff)
+):
+    """Bulk-register a CSV or JSONL roster, optionally with a zip of photos.
+
+    Columns are the same as the single-record form fields plus "photo",
+    the file name of the row's picture inside the zip.
+    """
+    spec = roster_spec(kind)
+    format = roster_format(format, roster.filename)
+    if not roster_import_lock.acquire(blocking=False):
+        raise HTTPException(status_code=429, detail="Another roster import is running", headers={"Retry-After": "30"})
+    try:
+        archive = None
+        if photos is not None:
+            try:
+                archive = zipfile.ZipFile(photos.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="photos must be a zip archive")
+
+        job = RosterImport(spec, archive, dry_run)
+        start = time.perf_counter()
+        report = await run_in_threadpool(job.run, read_roster_rows(roster.file, format))
+        report["seconds"] = round(time.perf_counter() - start, 2)
+
+        # ID cards need their QR codes - queued as one batch like /qr/regenerate/
+        if kind == "idcards" and job.keys:
+            batch = uuid.uuid4().hex
+            cards = await db_run(db_query, f"""
+                SELECT rowid, roll_number, name, time_epoch FROM student_id
+                WHERE roll_number COLLATE NOCASE IN ({','.join('?' * len(job.keys))})
+            """, job.keys)
+            await queue_card_qrs(cards, batch)
+            report["qr_batch"] = f"{BASE_URL}/qr/batches/{batch}"
+        return report
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in import_roster: {e}")
+        raise HTTPException(status_code=500, detail="Roster import failed")
+    finally:
+        roster_import_lock.release()
+        await roster.close()
+        if photos is not None:
+            await photos.close()
+
+def export_roster_rows(spec, format):
+    photo_column = spec["photo"][0]
+    columns = spec["columns"] + ["photo", "time"]
+    if format == "csv":
+        yield ",".join(columns) + "\r\n"
+    last_rowid = 0
+    while True:
+        # Keyset pages on rowid so each query stays cheap however far in we
+        # are - rowid, not id, because older databases may not have an id column
+        rows = db_query(
+            f"SELECT rowid, {', '.join(spec['columns'])}, {photo_column}, time FROM {spec['table']} "
+            f"WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, ROSTER_BATCH_SIZE)
+        )
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        out = io.StringIO()
+        writer = csv.writer(out) if format == "csv" else None
+        for row in rows:
+            values = list(row[1:-2]) + [media_url(row[-2]) if row[-2] else "", row[-1]]
+            if writer:
+                writer.writerow(values)
+            else:
+                out.write(json.dumps(dict(zip(columns, values))) + "\n")
+        yield out.getvalue()
+
+@app.get("/roster/{kind}/export")
+def export_roster(kind: str, format: str = Query("csv"), session: dict = Depends(require_staff)):
+    """Stream every row of a roster as CSV or JSONL (passwords excluded)."""
+    spec = roster_spec(kind)
+    format = roster_format(format)
+    return StreamingResponse(
+        export_roster_rows(spec, format),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'}
+    )
+
 # ========================================
 # SENIOR-JUNIOR CONNECT ENDPOINTS
 # ========================================
 
+MATCH_LIMIT = 10
+
+# Common spellings folded onto one canonical skill name
+SKILL_ALIASES = {
+    "ml": "machine learning",
+    "ai": "artificial intelligence",
+    "js": "javascript",
+    "py": "python",
+    "cpp": "c++",
+    "dsa": "data structures",
+    "ui/ux": "ui ux",
+}
+
+YEAR_WORDS = {"fy": 1, "first": 1, "sy": 2, "second": 2, "ty": 3, "third": 3, "ly": 4, "final": 4, "fourth": 4}
+
+UNAVAILABLE_WORDS = {"no", "none", "busy", "unavailable", "n/a", "na"}
+
+def normalize_skills(text):
+    skills = set()
+    for part in re.split(r"[,;/|\n]|\band\b", (text or "").lower()):
+        skill = " ".join(part.split())
+        if skill:
+            skills.add(SKILL_ALIASES.get(skill, skill))
+    return skills
+
+def parse_year(text):
+    text = (text or "").lower()
+    digits = re.search(r"\d", text)
+    if digits:
+        return int(digits.group())
+    for word, year in YEAR_WORDS.items():
+        if word in text.split():
+            return year
+    return None
+
+class SeniorMatcher:
+    """In-memory skill -> senior inverted index used for ranking mentors.
+
+    Loaded once at startup and topped up incrementally from senior_connect
+    (rows after the last seen rowid), so other workers' registrations show up
+    on the next match without a full reload.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seniors = {}
+        self.index = {}
+        self.last_rowid = 0
+
+    def init_db(self):
+        # Batch matching marks requests and stores the chosen seniors
+        columns = [row[1] for row in db_query("PRAGMA table_info(junior_request)")]
+        if columns and "status" not in columns:
+            db_execute("ALTER TABLE junior_request ADD COLUMN status TEXT NOT NULL DEFAULT 'open'")
+        if columns:
+            db_execute("CREATE INDEX IF NOT EXISTS idx_junior_request_status ON junior_request (status)")
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS junior_match (
+                junior_id INTEGER NOT NULL,
+                senior_id INTEGER NOT NULL,
+                score REAL NOT NULL,
+                time TEXT,
+                PRIMARY KEY (junior_id, senior_id)
+            )
+        """)
+
+    def refresh(self):
+        rows = db_query("""
+            SELECT rowid, name, branch, year, skills, availability, contact
+            FROM senior_connect WHERE rowid > ? ORDER BY rowid
+        """, (self.last_rowid,))
+        for row in rows:
+            self.add(*row)
+
+    def add(self, rowid, name, branch, year, skills, availability, contact):
+        senior = {
+            "id": rowid,
+            "name": name,
+            "branch": (branch or "").strip().lower(),
+            "year": parse_year(year),
+            "skills": normalize_skills(skills),
+            "available": not set((availability or "").lower().split()) & UNAVAILABLE_WORDS,
+            "availability": availability,
+            "contact": contact,
+        }
+        with self._lock:
+            if rowid in self.seniors:
+                return
+            self.seniors[rowid] = senior
+            for skill in senior["skills"]:
+                self.index.setdefault(skill, set()).add(rowid)
+            self.last_rowid = max(self.last_rowid, rowid)
+
+    def score(self, senior, needed, branch, year):
+        matched = senior["skills"] & needed
+        score = 10.0 * len(matched) / len(needed)
+        if branch and senior["branch"] == branch:
+            score += 2
+        if year and senior["year"]:
+            # Seniors a year or two ahead know the junior's syllabus best
+            gap = senior["year"] - year
+            score += 1.5 if 1 <= gap <= 2 else (0.5 if gap > 2 else -1)
+        score += 1 if senior["available"] else -3
+        return score, matched
+
+    def match(self, skills, branch=None, year=None, limit=MATCH_LIMIT, load=None):
+        """Rank seniors for the wanted skills. `load` maps senior id -> juniors
+        already assigned in this run, to spread a batch across mentors."""
+        needed = normalize_skills(skills) if isinstance(skills, str) else set(skills)
+        if not needed:
+            return []
+        branch = (branch or "").strip().lower()
+        year = parse_year(year) if isinstance(year, str) else year
+        with self._lock:
+            candidates = set()
+            for skill in needed:
+                candidates |= self.index.get(skill, set())
+            seniors = [self.seniors[rowid] for rowid in candidates]
+
+        ranked = []
+        for senior in seniors:
+            score, matched = self.score(senior, needed, branch, year)
+            if load:
+                score -= 0.5 * load.get(senior["id"], 0)
+            ranked.append((score, senior, matched))
+        ranked.sort(key=lambda item: (-item[0], item[1]["name"] or ""))
+        return [{
+            "id": senior["id"],
+            "name": senior["name"],
+            "contact": senior["contact"],
+            "availability": senior["availability"],
+            "matched_skills": sorted(matched),
+            "score": round(score, 2)
+        } for score, senior, matched in ranked[:limit]]
+
+senior_matcher = SeniorMatcher()
+
 @app.post("/connect/register_senior/")
 def register_senior(
     name: str = Form(...),
@@ -456,14 +3500,12 @@ def register_senior(
     contact: str = Form(...)
 ):
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
+        senior_id = db_execute("""
             INSERT INTO senior_connect (name, branch, year, skills, availability, contact)
             VALUES (?, ?, ?, ?, ?, ?)
         """, (name, branch, year, skills, availability, contact))
-        conn.commit()
-        conn.close()
+        senior_matcher.add(senior_id, name, branch, year, skills, availability, contact)
+        response_cache.invalidate("seniors")
         return {"message": "Senior registered successfully!"}
     except Exception as e:
         print(f"Error in register_senior: {e}")
@@ -478,76 +3520,708 @@ def request_junior(
     skill_needed: str = Form(...)
 ):
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO junior_request (name, branch, year, query, skill_needed)
-            VALUES (?, ?, ?, ?, ?)
-        """, (name, branch, year, query, skill_needed))
-        conn.commit()
-        conn.close()
-        return {"message": "Junior request submitted successfully!"}
+        with db_pool.transaction() as conn:
+            request_id = conn.execute("""
+                INSERT INTO junior_request (name, branch, year, query, skill_needed)
+                VALUES (?, ?, ?, ?, ?)
+            """, (name, branch, year, query, skill_needed)).lastrowid
+            publish(conn, "junior_request.created", {"id": request_id, "skill_needed": skill_needed})
+        event_bus.notify()
+        # Suggested mentors arrive as a junior_request.matched event
+        return {"message": "Junior request submitted successfully!", "request_id": request_id}
     except Exception as e:
         print(f"Error in request_junior: {e}")
         raise HTTPException(status_code=500, detail="Request failed")
 
 @app.get("/connect/match/")
-def match_junior_to_senior(skill: str):
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT name, contact, availability FROM senior_connect
-            WHERE skills LIKE ?
-        """, (f'%{skill}%',))
-        matches = cursor.fetchall()
-        conn.close()
+def match_junior_to_senior(request: Request, skill: str, branch: str = None, year: str = None, limit: int = Query(MATCH_LIMIT, ge=1, le=100)):
+    return response_cache.serve(
+        request, "seniors", query_key(request),
+        lambda: rank_seniors(skill, branch, year, limit)
+    )
+
+def rank_seniors(skill, branch=None, year=None, limit=MATCH_LIMIT):
+    try:
+        senior_matcher.refresh()
+        matches = senior_matcher.match(skill, branch, year, limit)
+        if not matches:
+            # Nothing with that exact skill - fall back to word search ("learning")
+            matches = search_seniors(skill, limit)
         
-        return [{"name": match[0], "contact": match[1], "availability": match[2]} for match in matches]
+        return [{
+            "name": match["name"],
+            "contact": match["contact"],
+            "availability": match["availability"],
+            "matched_skills": match.get("matched_skills", []),
+            "score": match["score"]
+        } for match in matches]
     except Exception as e:
         print(f"Error in match_junior_to_senior: {e}")
         raise HTTPException(status_code=500, detail="Matching failed")
 
+@app.post("/connect/match_all/")
+def match_all_juniors(top: int = Form(3), session: dict = Depends(require_staff)):
+    # Start-of-semester run: rank mentors for every open request in one pass
+    try:
+        senior_matcher.refresh()
+        requests = db_query("""
+            SELECT rowid, name, branch, year, skill_needed FROM junior_request
+            WHERE status = 'open' ORDER BY rowid
+        """)
+
+        load = {}
+        results = []
+        pairs = []
+        for junior_id, name, branch, year, skill_needed in requests:
+            matches = senior_matcher.match(skill_needed, branch, year, top, load)
+            for match in matches[:1]:
+                load[match["id"]] = load.get(match["id"], 0) + 1
+            pairs.extend((junior_id, match["id"], match["score"]) for match in matches)
+            results.append({"junior": name, "skill_needed": skill_needed, "matches": matches})
+
+        now = datetime.now().strftime(TIME_FORMAT)
+        matched_ids = sorted({pair[0] for pair in pairs})
+        with db_pool.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO junior_match (junior_id, senior_id, score, time) VALUES (?, ?, ?, ?)",
+                [(*pair, now) for pair in pairs]
+            )
+            conn.executemany("UPDATE junior_request SET status = 'matched' WHERE rowid = ?", [(i,) for i in matched_ids])
+
+        return {
+            "requests": len(requests),
+            "matched": len(matched_ids),
+            "unmatched": len(requests) - len(matched_ids),
+            "results": results
+        }
+    except Exception as e:
+        print(f"Error in match_all_juniors: {e}")
+        raise HTTPException(status_code=500, detail="Matching failed")
+
+# ========================================
+# SEARCH ENDPOINTS
+# ========================================
+
+SEARCH_LIMIT = 20
+
+# FTS5 indexes over existing tables (external content), kept in sync by triggers.
+# Skills keep "+" and "#" inside tokens so "c", "c++" and "c#" stay distinct.
+SEARCH_INDEXES = {
+    "lost_item_fts": {
+        "table": "lost_item",
+        "columns": ["item_name", "item_description"],
+        "options": "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'",
+    },
+    "senior_skill_fts": {
+        "table": "senior_connect",
+        "columns": ["skills"],
+        "options": "tokenize = \"unicode61 remove_diacritics 2 tokenchars '+#'\"",
+    },
+}
+
+def init_search_index():
+    existing = {row[0] for row in db_query("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+    for fts, spec in SEARCH_INDEXES.items():
+        table = spec["table"]
+        if table not in existing:
+            continue
+        cols = ", ".join(spec["columns"])
+        new_cols = ", ".join(f"new.{c}" for c in spec["columns"])
+        old_cols = ", ".join(f"old.{c}" for c in spec["columns"])
+        with db_pool.transaction() as conn:
+            conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts}
+                USING fts5({cols}, content = '{table}', content_rowid = 'rowid', {spec["options"]})
+            """)
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts} (rowid, {cols}) VALUES (new.rowid, {new_cols});
+                END
+            """)
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+                END
+            """)
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+                    INSERT INTO {fts} (rowid, {cols}) VALUES (new.rowid, {new_cols});
+                END
+            """)
+            if fts not in existing:
+                # First run - index the rows that are already there
+                conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def fts_query(text, prefix=False):
+    """Turn free text into a safe FTS5 MATCH expression (None if nothing to search)."""
+    tokens = re.findall(r"[\w+#]+", text.lower())
+    if not tokens:
+        return None
+    if prefix:
+        # Every word must match, the last one may be partially typed
+        return " ".join(f'"{t}"' for t in tokens[:-1]) + f' "{tokens[-1]}"*'
+    # Multi-word skills like "machine learning" match as a phrase
+    return '"' + " ".join(tokens) + '"'
+
+def search_lost_items(q, limit=SEARCH_LIMIT):
+    match = fts_query(q, prefix=True)
+    if not match:
+        return []
+    rows = db_query("""
+        SELECT l.item_name, l.item_description, l.file_path, m.variants, l.time_epoch, bm25(lost_item_fts) AS score
+        FROM lost_item_fts
+        JOIN lost_item l ON l.rowid = lost_item_fts.rowid
+        LEFT JOIN media_blob m ON m.path = l.file_path
+        WHERE lost_item_fts MATCH ?
+        ORDER BY score
+        LIMIT ?
+    """, (match, limit))
+    return [{
+        "name": row[0],
+        "desc": row[1],
+        "img": media_url(row[2], row[3] or "", "thumb"),
+        "img_full": media_url(row[2]),
+        "time": row[4],
+        "score": round(-row[5], 4)
+    } for row in rows]
+
+def search_seniors(skill, limit=SEARCH_LIMIT):
+    match = fts_query(skill)
+    if not match:
+        return []
+    rows = db_query("""
+        SELECT s.name, s.branch, s.year, s.skills, s.availability, s.contact, bm25(senior_skill_fts) AS score
+        FROM senior_skill_fts
+        JOIN senior_connect s ON s.rowid = senior_skill_fts.rowid
+        WHERE senior_skill_fts MATCH ?
+        ORDER BY score
+        LIMIT ?
+    """, (match, limit))
+    return [{
+        "name": row[0],
+        "branch": row[1],
+        "year": row[2],
+        "skills": row[3],
+        "availability": row[4],
+        "contact": row[5],
+        "score": round(-row[6], 4)
+    } for row in rows]
+
+@app.get("/search/lost_items/")
+def search_lost_items_endpoint(q: str, limit: int = Query(SEARCH_LIMIT, ge=1, le=100)):
+    try:
+        return search_lost_items(q, limit)
+    except Exception as e:
+        print(f"Error in search_lost_items: {e}")
+        raise HTTPException(status_code=500, detail="Search failed")
+
+@app.get("/search/seniors/")
+def search_seniors_endpoint(skill: str, limit: int = Query(SEARCH_LIMIT, ge=1, le=100)):
+    try:
+        return search_seniors(skill, limit)
+    except Exception as e:
+        print(f"Error in search_seniors: {e}")
+        raise HTTPException(status_code=500, detail="Search failed")
+
+# ========================================
+# EVENTS
+# ========================================
+
+# Writes record an event in event_outbox inside the same transaction as the
+# row it describes, so a crash can't lose one. Every worker tails the outbox
+# and pushes new events to its own SSE / WebSocket subscribers; events that
+# have a consumer are claimed by exactly one worker and retried on failure.
+EVENT_POLL_INTERVAL = 1.0     # seconds between outbox polls when nothing wakes us
+EVENT_LEASE_SECONDS = 60      # a claimed event goes back to the queue after this
+EVENT_MAX_ATTEMPTS = 5
+EVENT_BATCH = 200
+EVENT_RETENTION_ROWS = 10000  # finished events kept for Last-Event-ID replay
+EVENT_QUEUE_SIZE = 100        # per subscriber; a slow client loses the oldest events
+EVENT_HEARTBEAT = 15          # seconds between keep-alives on idle streams
+
+def publish(conn, topic, payload):
+    """Record an event in the caller's transaction; call event_bus.notify() after commit."""
+    status = "pending" if topic in event_bus.consumers else "done"
+    return conn.execute(
+        "INSERT INTO event_outbox (topic, payload, status, time) VALUES (?, ?, ?, ?)",
+        (topic, json.dumps(payload), status, datetime.now().strftime(TIME_FORMAT))
+    ).lastrowid
+
+def event_dict(row):
+    event_id, topic, payload, created = row
+    return {"id": event_id, "topic": topic, "data": json.loads(payload), "time": created}
+
+class Subscription:
+    def __init__(self, topics=None):
+        self.topics = topics
+        self.queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+
+    def offer(self, event):
+        # None is the shutdown signal and always goes through
+        if event is not None and self.topics and event["topic"] not in self.topics:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            event_bus.stats["dropped"] += 1
+        self.queue.put_nowait(event)
+
+class EventBus:
+    """Outbox dispatcher: fans events out to subscribers and runs consumers."""
+
+    def __init__(self):
+        self.consumers = {}
+        self.subscribers = set()
+        self.last_id = 0
+        self.loop = None
+        self.task = None
+        self._wake = None
+        self.stats = {"delivered": 0, "consumed": 0, "failed": 0, "dropped": 0}
+
+    def consumer(self, topic):
+        """Decorator: run func(conn, data) once per `topic` event, in the event's transaction."""
+        def register(func):
+            self.consumers[topic] = func
+            return func
+        return register
+
+    def init_db(self):
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS event_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_at REAL,
+                error TEXT,
+                time TEXT
+            )
+        """)
+        db_execute("CREATE INDEX IF NOT EXISTS idx_event_outbox_status ON event_outbox (status, id)")
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        # Subscribers only see events from now on (older ones via Last-Event-ID)
+        self.last_id = (await db_run(db_query, "SELECT MAX(id) FROM event_outbox", one=True))[0] or 0
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+        for subscription in list(self.subscribers):
+            subscription.offer(None)
+
+    def notify(self):
+        # Callable from any thread: dispatch now instead of at the next poll
+        if self.loop:
+            with suppress(RuntimeError):
+                self.loop.call_soon_threadsafe(self._wake.set)
+
+    def subscribe(self, topics=None):
+        subscription = Subscription(topics)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    def replay(self, after, upto, topics=None):
+        """Events in (after, upto] for a client reconnecting with Last-Event-ID."""
+        rows = db_query(
+            "SELECT id, topic, payload, time FROM event_outbox WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+            (after, upto, EVENT_BATCH)
+        )
+        return [event_dict(row) for row in rows if not topics or row[1] in topics]
+
+    async def _run(self):
+        cycles = 0
+        while True:
+            self._wake.clear()
+            try:
+                busy = await self._fan_out() + await self._consume()
+                cycles += 1
+                if cycles % 600 == 0:
+                    await db_run(self._prune)
+            except Exception as e:
+                print(f"Error in event dispatcher: {e}")
+                busy = 0
+            if not busy:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), EVENT_POLL_INTERVAL)
+
+    async def _fan_out(self):
+        rows = await db_run(
+            db_query,
+            "SELECT id, topic, payload, time FROM event_outbox WHERE id > ? ORDER BY id LIMIT ?",
+            (self.last_id, EVENT_BATCH)
+        )
+        for row in rows:
+            self.last_id = row[0]
+            event = event_dict(row)
+            for subscription in list(self.subscribers):
+                subscription.offer(event)
+                self.stats["delivered"] += 1
+        return len(rows)
+
+    async def _consume(self):
+        claimed = await db_run(self._claim)
+        for event_id, topic, payload, attempts in claimed:
+            try:
+                await db_run(self._handle, event_id, topic, json.loads(payload))
+                self.stats["consumed"] += 1
+            except Exception as e:
+                print(f"Event {event_id} ({topic}) failed: {e}")
+                self.stats["failed"] += 1
+                status = "failed" if attempts >= EVENT_MAX_ATTEMPTS else "pending"
+                await db_run(db_execute, "UPDATE event_outbox SET status = ?, error = ? WHERE id = ?", (status, str(e), event_id))
+        return len(claimed)
+
+    def _claim(self):
+        now = time.time()
+        # Cheap read first so idle workers don't take the write lock every poll
+        waiting = db_query("""
+            SELECT EXISTS (SELECT 1 FROM event_outbox
+                           WHERE status = 'pending' OR (status = 'processing' AND claimed_at < ?))
+        """, (now - EVENT_LEASE_SECONDS,), one=True)[0]
+        if not waiting:
+            return []
+        with db_pool.transaction() as conn:
+            # Events whose worker died half-way go back to the queue
+            conn.execute(
+                "UPDATE event_outbox SET status = 'pending' WHERE status = 'processing' AND claimed_at < ?",
+                (now - EVENT_LEASE_SECONDS,)
+            )
+            rows = conn.execute("""
+                UPDATE event_outbox SET status = 'processing', claimed_at = ?, attempts = attempts + 1
+                WHERE id IN (SELECT id FROM event_outbox WHERE status = 'pending' ORDER BY id LIMIT 20)
+                RETURNING id, topic, payload, attempts
+            """, (now,)).fetchall()
+        return sorted(rows)
+
+    def _handle(self, event_id, topic, data):
+        with db_pool.transaction() as conn:
+            self.consumers[topic](conn, data)
+            conn.execute("UPDATE event_outbox SET status = 'done', error = NULL WHERE id = ?", (event_id,))
+
+    def _prune(self):
+        db_execute("DELETE FROM event_outbox WHERE status = 'done' AND id <= ?", (self.last_id - EVENT_RETENTION_ROWS,))
+
+    def snapshot(self):
+        return dict(self.stats, subscribers=len(self.subscribers), last_id=self.last_id, consumers=sorted(self.consumers))
+
+event_bus = EventBus()
+
+def parse_topics(topics):
+    return {t.strip() for t in topics.split(",") if t.strip()} if topics else None
+
+def sse_format(event):
+    return f"id: {event['id']}\nevent: {event['topic']}\ndata: {json.dumps(event)}\n\n"
+
+@app.get("/events/stream")
+async def event_stream(topics: str = None, last_event_id: str = Header(None)):
+    """Server-Sent Events, optionally filtered by a comma separated topic list.
+
+    Browsers resend Last-Event-ID when they reconnect; missed events are
+    replayed from the outbox first.
+    """
+    topic_set = parse_topics(topics)
+    subscription = event_bus.subscribe(topic_set)
+    upto = event_bus.last_id
+    try:
+        backlog = []
+        if last_event_id and last_event_id.isdigit():
+            backlog = await db_run(event_bus.replay, int(last_event_id), upto, topic_set)
+    except Exception as e:
+        event_bus.unsubscribe(subscription)
+        print(f"Error in event_stream: {e}")
+        raise HTTPException(status_code=500, detail="Event stream failed")
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            for event in backlog:
+                yield sse_format(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), EVENT_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Comment line - keeps proxies from closing an idle stream
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    return
+                yield sse_format(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/events/ws")
+async def event_socket(websocket: WebSocket, topics: str = None):
+    await websocket.accept()
+    subscription = event_bus.subscribe(parse_topics(topics))
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), EVENT_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Also how a silently dropped client gets noticed
+                await websocket.send_json({"topic": "ping"})
+                continue
+            if event is None:
+                await websocket.close(code=1001)
+                return
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        event_bus.unsubscribe(subscription)
+
+# ========================================
+# MATCH CONSUMERS
+# ========================================
+
+LOST_MATCH_MIN_SCORE = 0.5
+LOST_REPORT_DAYS = 30   # reports older than this stop being matched
+JUNIOR_AUTO_MATCH = 3   # seniors suggested for each new junior request
+
+MATCH_STOPWORDS = {"the", "and", "with", "near", "found", "lost", "color", "colour", "has", "have", "was", "from", "for"}
+
+def match_terms(text):
+    return {w for w in re.findall(r"\w+", (text or "").lower()) if len(w) > 2 and w not in MATCH_STOPWORDS}
+
+def lost_match_score(report_name, report_desc, item_name, item_desc):
+    # Share of the report's item-name words found on the item, plus half
+    # credit for the extra description words ("blue", "steel", ...)
+    item_terms = match_terms(f"{item_name} {item_desc}")
+    name_terms = match_terms(report_name)
+    if not name_terms or not item_terms:
+        return 0.0
+    score = len(name_terms & item_terms) / len(name_terms)
+    desc_terms = match_terms(report_desc) - name_terms
+    if desc_terms:
+        score += 0.5 * len(desc_terms & item_terms) / len(desc_terms)
+    return round(score, 3)
+
+def record_lost_match(conn, report_id, item_id, item_name, score):
+    inserted = conn.execute(
+        "INSERT OR IGNORE INTO lost_match (report_id, item_id, score, time) VALUES (?, ?, ?, ?)",
+        (report_id, item_id, score, datetime.now().strftime(TIME_FORMAT))
+    ).rowcount
+    if inserted:
+        publish(conn, "lost_report.matched", {"report_id": report_id, "item_id": item_id, "item_name": item_name, "score": score})
+
+@event_bus.consumer("lost_item.created")
+def match_found_item(conn, data):
+    item = conn.execute("SELECT item_name, item_description FROM lost_item WHERE rowid = ?", (data["id"],)).fetchone()
+    if not item:
+        return
+    reports = conn.execute(
+        "SELECT id, item_name, description FROM lost_report WHERE time_epoch >= ?",
+        (int(time.time()) - LOST_REPORT_DAYS * 86400,)
+    ).fetchall()
+    for report_id, name, description in reports:
+        score = lost_match_score(name, description, *item)
+        if score >= LOST_MATCH_MIN_SCORE:
+            record_lost_match(conn, report_id, data["id"], item[0], score)
+
+@event_bus.consumer("lost_report.created")
+def match_lost_report(conn, data):
+    report = conn.execute("SELECT item_name, description FROM lost_report WHERE id = ?", (data["id"],)).fetchone()
+    terms = match_terms(report[0]) if report else None
+    if not terms:
+        return
+    # Any of the item-name words narrows the candidates; scoring decides
+    rows = conn.execute("""
+        SELECT l.rowid, l.item_name, l.item_description FROM lost_item_fts
+        JOIN lost_item l ON l.rowid = lost_item_fts.rowid
+        WHERE lost_item_fts MATCH ? AND l.time_epoch >= ?
+        ORDER BY bm25(lost_item_fts) LIMIT ?
+    """, (" OR ".join(f'"{t}"' for t in terms), int(time.time()) - LOST_REPORT_DAYS * 86400, SEARCH_LIMIT)).fetchall()
+    for item_id, item_name, item_desc in rows:
+        score = lost_match_score(report[0], report[1], item_name, item_desc)
+        if score >= LOST_MATCH_MIN_SCORE:
+            record_lost_match(conn, data["id"], item_id, item_name, score)
+
+@event_bus.consumer("junior_request.created")
+def match_new_junior(conn, data):
+    junior = conn.execute(
+        "SELECT name, branch, year, skill_needed FROM junior_request WHERE rowid = ? AND status = 'open'", (data["id"],)
+    ).fetchone()
+    if not junior:
+        return
+    senior_matcher.refresh()
+    matches = senior_matcher.match(junior[3], junior[1], junior[2], JUNIOR_AUTO_MATCH)
+    if not matches:
+        return
+    now = datetime.now().strftime(TIME_FORMAT)
+    conn.executemany(
+        "INSERT OR REPLACE INTO junior_match (junior_id, senior_id, score, time) VALUES (?, ?, ?, ?)",
+        [(data["id"], match["id"], match["score"], now) for match in matches]
+    )
+    conn.execute("UPDATE junior_request SET status = 'matched' WHERE rowid = ?", (data["id"],))
+    publish(conn, "junior_request.matched", {
+        "request_id": data["id"],
+        "junior": junior[0],
+        "skill_needed": junior[3],
+        "matches": [{k: match[k] for k in ("name", "contact", "availability", "matched_skills", "score")} for match in matches]
+    })
+
 # ========================================
 # CHATBOT ENDPOINTS
 # ========================================
 
+CHATBOT_INTENTS_PATH = setting(
+    "chatbot_intents",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatbot_intents.json")
+)
+CHATBOT_CACHE_SIZE = 5000
+CHATBOT_RELOAD_CHECK = 2  # seconds between checks for an edited intents file
+
+def normalize_text(text):
+    # Lowercase, punctuation -> spaces, padded so " word " marks word boundaries
+    return " " + " ".join(re.sub(r"[^\w+#]+", " ", text.lower()).split()) + " "
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: finds every keyword in one pass over the text."""
+
+    def __init__(self, keywords):
+        # keywords: iterable of (pattern, value)
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pattern, value in keywords:
+            state = 0
+            for ch in pattern:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.out[state].append(value)
+
+        # Breadth-first fail links; each state inherits the outputs of its fail state
+        todo = deque(self.goto[0].values())
+        while todo:
+            state = todo.popleft()
+            for ch, nxt in self.goto[state].items():
+                todo.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def search(self, text):
+        state = 0
+        for ch in text:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if self.out[state]:
+                yield from self.out[state]
+
+class ChatbotEngine:
+    """Keyword intents from chatbot_intents.json, compiled into one automaton.
+
+    The best match is the intent with the highest priority (explicit
+    "priority", otherwise earlier in the file wins). Answers for normalized
+    queries are kept in an LRU cache, which is dropped whenever the intents
+    file is reloaded.
+    """
+
+    def __init__(self, path=CHATBOT_INTENTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.mtime = None
+        self.checked = 0
+        self.automaton = None
+        self.intents = []
+        self.fallback = ""
+        self.cache = OrderedDict()
+        self.stats = {"queries": 0, "cache_hits": 0, "reloads": 0}
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding="utf-8") as f:
+            config = json.load(f)
+        intents = config["intents"]
+        keywords = []
+        for index, intent in enumerate(intents):
+            rank = (intent.get("priority", 0), -index)
+            for keyword in intent["keywords"]:
+                pattern = normalize_text(keyword)
+                if pattern.strip():
+                    keywords.append((pattern, (rank, index)))
+        automaton = KeywordAutomaton(keywords)
+        with self._lock:
+            self.automaton = automaton
+            self.intents = intents
+            self.fallback = config.get("fallback", "")
+            self.mtime = mtime
+            self.cache = OrderedDict()
+            self.stats["reloads"] += 1
+
+    def maybe_reload(self):
+        # Hot reload: pick up edits to the intents file without a restart
+        now = time.time()
+        if now - self.checked < CHATBOT_RELOAD_CHECK:
+            return
+        self.checked = now
+        try:
+            if os.stat(self.path).st_mtime != self.mtime:
+                self.load()
+        except Exception as e:
+            print(f"Chatbot intents not reloaded, keeping previous version: {e}")
+
+    def answer(self, query):
+        self.maybe_reload()
+        text = normalize_text(query)
+        with self._lock:
+            self.stats["queries"] += 1
+            cached = self.cache.get(text)
+            if cached is not None:
+                self.cache.move_to_end(text)
+                self.stats["cache_hits"] += 1
+                return cached
+            automaton, intents, fallback = self.automaton, self.intents, self.fallback
+
+        best = max(automaton.search(text), default=None)
+        answer = intents[best[1]]["response"] if best else fallback
+
+        with self._lock:
+            self.cache[text] = answer
+            if len(self.cache) > CHATBOT_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return answer
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, intents=len(self.intents), cached=len(self.cache))
+
+chatbot = ChatbotEngine()
+
 @app.post("/chatbot/query")
 def chatbot_response(query: str = Form(...)):
-    query_lower = query.lower()
-    
-    responses = {
-        "rule": "College rules: 75% attendance required, ID card mandatory, ragging strictly prohibited.",
-        "regulation": "College rules: 75% attendance required, ID card mandatory, ragging strictly prohibited.",
-        "canteen": "Canteen opens at 9 AM and closes at 5 PM. Menu updates daily.",
-        "food": "Canteen opens at 9 AM and closes at 5 PM. Menu updates daily.",
-        "notes": "Study materials are available under the Notes section in X Campus.",
-        "study material": "Study materials are available under the Notes section in X Campus.",
-        "internship": "Internship listings are updated every Monday. Check the Internships tab.",
-        "job": "Internship listings are updated every Monday. Check the Internships tab.",
-        "new student": "Welcome! Begin with Dashboard, explore your schedule, and check out the canteen and notes.",
-        "how to start": "Welcome! Begin with Dashboard, explore your schedule, and check out the canteen and notes.",
-        "library": "Library is open from 8 AM to 8 PM. Carry your ID card to enter.",
-        "exam": "Mid-sem exams are in October, finals in March. Check Dashboard for exact dates.",
-        "test": "Mid-sem exams are in October, finals in March. Check Dashboard for exact dates.",
-        "attendance": "Minimum 75% attendance is mandatory to appear for exams.",
-        "id card": "Your college ID card must be carried at all times. It's needed for library, exams, and events.",
-        "ragging": "Ragging is strictly prohibited. Report any incident immediately to the authorities.",
-        "hostel": "Hostel curfew is 10 PM. Visitors allowed till 7 PM with prior permission.",
-        "sports": "Sports facilities include basketball, cricket, and gym. Timings: 4 PM to 7 PM.",
-        "events": "Upcoming events are listed in the Campus News section. Don't miss the annual fest!",
-        "fest": "Upcoming events are listed in the Campus News section. Don't miss the annual fest!",
-        "wifi": "Campus Wi-Fi is available in all blocks. Use your student credentials to login.",
-        "internet": "Campus Wi-Fi is available in all blocks. Use your student credentials to login.",
-        "contact": "For help, visit the Admin Office or use the Help section in X Campus.",
-        "help": "For help, visit the Admin Office or use the Help section in X Campus."
-    }
-    
-    for keyword, response in responses.items():
-        if keyword in query_lower:
-            return {"response": response}
-    
-    return {"response": "Sorry, I didn't understand that. Try asking about rules, canteen, notes, exams, or hostel."}
+    return {"response": chatbot.answer(query)}
+
+@app.post("/chatbot/reload")
+def chatbot_reload(session: dict = Depends(require_staff)):
+    try:
+        chatbot.load()
+    except Exception as e:
+        print(f"Error in chatbot_reload: {e}")
+        raise HTTPException(status_code=500, detail="Could not load chatbot intents")
+    return {"message": "Chatbot intents reloaded", **chatbot.snapshot()}
 
 # ========================================
 # ROOT ENDPOINT
@@ -563,8 +4237,84 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().strftime("%d %b %Y %H:%M:%S")}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().strftime("%d %b %Y %H:%M:%S"),
+        "db_pool": db_pool.snapshot() if db_pool else None,
+        "password_hashing": password_hasher.snapshot(),
+        "login_lockouts": login_limiter.snapshot(),
+        "token_cache": token_cache.snapshot(),
+        "chatbot": chatbot.snapshot(),
+        "response_cache": response_cache.snapshot(),
+        "events": event_bus.snapshot(),
+        "rate_limits": [store.snapshot() for store in rate_limiter_stores],
+        "qr_tokens": qr_verifier.snapshot(),
+        "image_processing": image_processor.snapshot()
+    }
 
-if __name__ == "__main__":
+@app.get("/health/schema")
+def schema_health():
+    return {
+        "version": schema_version(),
+        "latest": SCHEMA_VERSION,
+        "hot_queries": explain_hot_queries()
+    }
+
+def migrate_only():
+    """`python main.py migrate`: apply migrations and exit, e.g. before a deploy."""
+    global db_pool
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.chdir(DATA_DIR)
+    db_pool = ConnectionPool(db_path, size=1)
+    try:
+        with startup_lock(db_path + ".startup.lock"):
+            migrate()
+        print(f"Schema version {schema_version()}")
+        return 0 if check_query_plans() else 1
+    finally:
+        db_pool.close()
+
+def run():
+    """Production entry point: `python main.py`, configured via settings."""
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.chdir(DATA_DIR)
+    # Workers must share one signing key or tokens fail on the other workers
+    os.environ.setdefault("XCAMPUS_SECRET_KEY", SECRET_KEY)
+    uvicorn.run(
+        "main:app",
+        app_dir=app_dir,
+        host=HOST,
+        port=PORT,
+        workers=1 if RELOAD else WORKERS,
+        reload=RELOAD,
+        reload_dirs=[app_dir] if RELOAD else None,
+        log_level=LOG_LEVEL,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+    )
+
+def approve_staff_only(email, approved=True):
+    """`python main.py approve-staff EMAIL`: grant staff rights, e.g. to the first admin."""
+    global db_pool
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.chdir(DATA_DIR)
+    db_pool = ConnectionPool(db_path, size=1)
+    try:
+        with startup_lock(db_path + ".startup.lock"):
+            migrate()
+        if not set_staff_approval(email, approved):
+            print(f"No staff account registered with {email}")
+            return 1
+        print(f"{email}: staff rights {'granted' if approved else 'withdrawn'}")
+        return 0
+    finally:
+        db_pool.close()
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        sys.exit(migrate_only())
+    if len(sys.argv) == 3 and sys.argv[1] in ("approve-staff", "revoke-staff"):
+        sys.exit(approve_staff_only(sys.argv[2], sys.argv[1] == "approve-staff"))
+    run()
\ No newline at end of file
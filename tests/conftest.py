@@ -0,0 +1,27 @@
+import importlib
+import os
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    """The app module, imported from the repo root inside a temp directory.
+
+    A fixed key keeps the import from writing secret.key.
+    """
+    monkeypatch.setenv("XCAMPUS_SECRET_KEY", "test-secret-key")
+    monkeypatch.syspath_prepend(REPO_ROOT)
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("main")
+
+
+@pytest.fixture
+def database(main, tmp_path, monkeypatch):
+    """A fresh SQLite file with the app's pool pointed at it."""
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(main, "db_pool", main.ConnectionPool(path, size=1))
+    yield path
+    main.db_pool.close()
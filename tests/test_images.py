@@ -0,0 +1,20 @@
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_process_image_strips_exif_and_comment(main, tmp_path):
+    src = str(tmp_path / "upload.jpg")
+    dest = str(tmp_path / "media" / "stored.jpg")
+    exif = Image.Exif()
+    exif[0x010F] = "Camera Maker"  # Make
+    Image.new("RGB", (64, 48), "red").save(src, "JPEG", exif=exif.tobytes(), comment=b"taken at home")
+    with Image.open(src) as img:
+        assert "exif" in img.info and "comment" in img.info
+
+    main.process_image(src, dest, {}, 1024, 85)
+
+    with Image.open(dest) as img:
+        assert "exif" not in img.info
+        assert "comment" not in img.info
+        assert not img.getexif()
@@ -0,0 +1,16 @@
+def test_import_reports_rows_registered_since_validation(main, database, monkeypatch):
+    main.migrate()
+    main.db_execute("INSERT INTO student_id (name, roll_number, password) VALUES ('Taken', 'R2', 'x')")
+    # The duplicate check ran before R2 was registered elsewhere
+    db_query = main.db_query
+    monkeypatch.setattr(main, "db_query", lambda *args, **kwargs: [])
+
+    fields = {"branch": "CE", "year": "SY", "college_name": "X", "college_contact": "1", "password": "pw"}
+    rows = [(line, dict(fields, name=f"Student {roll}", roll_number=roll), None)
+            for line, roll in ((2, "R1"), (3, "R2"), (4, "R3"))]
+    report = main.RosterImport(main.ROSTERS["idcards"]).run(rows)
+
+    assert report["imported"] == 2
+    assert report["errors"] == [{"line": 3, "error": "roll_number already registered"}]
+    rolls = [row[0] for row in db_query("SELECT roll_number FROM student_id ORDER BY roll_number")]
+    assert rolls == ["R1", "R2", "R3"]
@@ -0,0 +1,32 @@
+import sqlite3
+
+
+def test_migrate_reaches_latest_version(main, database):
+    main.migrate()
+    assert main.schema_version() == main.SCHEMA_VERSION
+
+
+def test_migrate_is_idempotent(main, database):
+    main.migrate()
+    main.migrate()
+    conn = sqlite3.connect(database)
+    versions = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    conn.close()
+    assert versions == [version for version, _, _ in main.MIGRATIONS]
+
+
+def test_hot_queries_use_indexes(main, database):
+    main.migrate()
+    plans = main.explain_hot_queries()
+    assert set(plans) == set(main.HOT_QUERIES)
+    full_scans = {name: result["plan"] for name, result in plans.items() if result["full_scan"]}
+    assert not full_scans
+
+
+def test_lookup_indexes_are_unique(main, database):
+    main.migrate()
+    conn = sqlite3.connect(database)
+    indexes = {row[0]: row[1] for row in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    for name, _, _ in main.LOOKUP_INDEXES:
+        assert indexes[name].startswith("CREATE UNIQUE")
@@ -0,0 +1,54 @@
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(main, monkeypatch):
+    # Any upload that gets past the middleware fails loudly
+    async def unexpected(*args, **kwargs):
+        raise AssertionError("form was parsed")
+    monkeypatch.setattr(main, "save_upload", unexpected)
+    return TestClient(main.app)
+
+
+def test_oversized_upload_rejected_before_parsing(main, client):
+    limit = main.UPLOAD_BODY_LIMITS["/item/lost_item/"]
+    response = client.post(
+        "/item/lost_item/", content=b"x" * (limit + 1),
+        headers={"Content-Type": "multipart/form-data; boundary=b"}
+    )
+    assert response.status_code == 413
+
+
+def test_chunked_upload_stops_at_limit(main, client):
+    limit = main.UPLOAD_BODY_LIMITS["/item/lost_item/"]
+    sent = 0
+
+    def body():
+        nonlocal sent
+        while sent <= limit * 2:
+            sent += 64 * 1024
+            yield b"x" * (64 * 1024)
+
+    response = client.post(
+        "/item/lost_item/", content=body(),
+        headers={"Content-Type": "multipart/form-data; boundary=b"}
+    )
+    assert response.status_code == 413
+
+
+def test_reupload_of_rejected_blob_is_refused(main, database, tmp_path):
+    main.migrate()
+    digest = "ab" * 32
+    main.db_execute(
+        "INSERT INTO media_blob (hash, path, size, refcount, status, error) VALUES (?, ?, 3, 1, 'rejected', 'bad image')",
+        (digest, main.media_store.blob_path(digest, ".jpg"))
+    )
+    upload = tmp_path / "upload.part"
+    upload.write_bytes(b"\xff\xd8\xff")
+
+    with pytest.raises(ValueError, match="bad image"):
+        main.media_store.ingest(str(upload), digest, 3, ".jpg")
+
+    row = main.db_query("SELECT refcount, status FROM media_blob WHERE hash = ?", (digest,), one=True)
+    assert tuple(row) == (1, "rejected")